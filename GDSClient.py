@@ -2,22 +2,48 @@
 
 
 import asyncio
+import base64
+import bisect
+import csv
+import hashlib
+import heapq
+import importlib
+import itertools
 import json
+import mmap
 import msgpack
 import pathlib
+import queue
+import random
+import re
 import ssl
+import struct
 import sys
+import threading
 import time
 import uuid
 import websockets
 
+from collections import OrderedDict
 from datetime import datetime
 from enum import Enum
-from OpenSSL import crypto
 import tempfile
 import os
-from multiprocessing import Process, Pool, Value
-import concurrent
+import concurrent.futures
+
+# the optional and the heavy modules are imported only when they are used first
+_modules = dict()
+
+def optional_module(name: str):
+    """
+    Imports the module on its first use, returns None if it is not installed.
+    """
+    if(name not in _modules):
+        try:
+            _modules[name] = importlib.import_module(name)
+        except ImportError:
+            _modules[name] = None
+    return _modules[name]
 
 class MessageException(Exception):
     pass
@@ -59,13 +85,224 @@ class StatusCode(Enum):
     BANDWIDTH_LIMIT_EXCEEDED = 509
     NOT_EXTENDED = 510
 
+
+# the message types by their values, without the lookup of DataType(value)
+DATA_TYPES = tuple(DataType)
+
+class Header:
+    """
+    A view over a decoded message (list) for reading its header fields by name. It does not copy the message,
+    every field is read from the list only when it is accessed, and the list is still available as `message`.
+    Header.of(message) returns the view of the message by its type (EventAck, AttachmentAck, QueryAck, ...).
+    """
+    __slots__ = ('message',)
+
+    def __init__(self, message: list):
+        self.message = message
+
+    @staticmethod
+    def of(message: list) -> 'Header':
+        return VIEWS.get(message[9], Ack if message[9] & 1 else Header)(message)
+
+    @property
+    def username(self) -> str:
+        return self.message[0]
+
+    @property
+    def msgid(self) -> str:
+        return self.message[1]
+
+    @property
+    def create_time(self) -> int:
+        return self.message[2]
+
+    @property
+    def request_time(self) -> int:
+        return self.message[3]
+
+    @property
+    def fragmented(self) -> bool:
+        return self.message[4]
+
+    @property
+    def first_fragment(self) -> bool:
+        return self.message[5]
+
+    @property
+    def last_fragment(self) -> bool:
+        return self.message[6]
+
+    @property
+    def offset(self) -> int:
+        return self.message[7]
+
+    @property
+    def full_data_size(self) -> int:
+        return self.message[8]
+
+    @property
+    def type(self) -> DataType:
+        return DATA_TYPES[self.message[9]]
+
+    @property
+    def data(self):
+        return self.message[10]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.type.name}, msgid: {self.msgid})"
+
+
+class Ack(Header):
+    """
+    The view of an ACK message: `[global status, body, error]`.
+    """
+    __slots__ = ()
+
+    @property
+    def status(self) -> int:
+        data = self.message[10]
+        return data[0] if data is not None else None
+
+    @property
+    def body(self):
+        return self.message[10][1]
+
+    @property
+    def error(self):
+        return self.message[10][2]
+
+    def is_ok(self, ok_statuses=(200,)) -> bool:
+        data = self.message[10]
+        return data is not None and data[0] in ok_statuses
+
+    def raise_for_status(self, ok_statuses=(200,)):
+        if(not self.is_ok(ok_statuses)):
+            raise MessageException(
+                f"The {self.type.name} message was not successful! Status: {self.status}, details: {self.error}")
+        return self
+
+
+class EventAck(Ack):
+    """
+    The view of an EVENT_ACK or EVENT_DOCUMENT_ACK message, the body is the list of the results of the operations
+    (or records): `[status, message, returned fields]`.
+    """
+    __slots__ = ()
+
+    @property
+    def results(self) -> list:
+        return self.message[10][1]
+
+
+class AttachmentAck(Ack):
+    """
+    The view of an ATTACHMENT_REQUEST_ACK or an ATTACHMENT_RESPONSE message. The `result` is the dictionary
+    which holds the attachment (if it is present already).
+    """
+    __slots__ = ()
+
+    @property
+    def result(self) -> dict:
+        data = self.message[10]
+        if(self.message[9] == DataType.ATTACHMENT_RESPONSE.value):
+            return data[0]
+        return data[1][1] if data is not None and data[1] is not None else None
+
+    @property
+    def attachment(self):
+        result = self.result
+        return result.get('attachment') if result is not None else None
+
+    @property
+    def attachmentid(self) -> str:
+        result = self.result
+        return result.get('attachmentid') if result is not None else None
+
+    @property
+    def meta(self) -> str:
+        result = self.result
+        return result.get('meta') if result is not None else None
+
+    @property
+    def requestids(self) -> list:
+        result = self.result
+        return result.get('requestids') if result is not None else None
+
+    @property
+    def ownertable(self) -> str:
+        result = self.result
+        return result.get('ownertable') if result is not None else None
+
+
+class QueryAck(Ack):
+    """
+    The view of a QUERY_REQUEST_ACK message (one page of a query).
+    """
+    __slots__ = ()
+
+    @property
+    def number_of_hits(self) -> int:
+        return self.message[10][1][0]
+
+    @property
+    def filtered_hits(self) -> int:
+        return self.message[10][1][1]
+
+    @property
+    def has_more_pages(self) -> bool:
+        return self.message[10][1][2]
+
+    @property
+    def context(self) -> list:
+        return self.message[10][1][3]
+
+    @property
+    def fielddescriptors(self) -> list:
+        return self.message[10][1][4]
+
+    @property
+    def records(self):
+        return self.message[10][1][5]
+
+    @records.setter
+    def records(self, records):
+        self.message[10][1][5] = records
+
+
+VIEWS = dict({
+    DataType.EVENT_ACK.value: EventAck,
+    DataType.ATTACHMENT_REQUEST_ACK.value: AttachmentAck,
+    DataType.ATTACHMENT_RESPONSE.value: AttachmentAck,
+    DataType.EVENT_DOCUMENT_ACK.value: EventAck,
+    DataType.QUERY_REQUEST_ACK.value: QueryAck
+})
+
+
 class GDSClient:
     def __init__(self, **kwargs):
         self.url = kwargs.get('url', "ws://127.0.0.1:8888/gate")
         self.username = kwargs.get('username', "user")
         self.password = kwargs.get('password')
         self.timeout = kwargs.get('timeout', 30)
-        self.ssl = None
+        self.fragment_unit = kwargs.get('fragment_unit')
+        if(self.fragment_unit is not None and self.fragment_unit <= 0):
+            raise ValueError("The value of 'fragment_unit' has to be positive!")
+        # binaries of at least this size are sent as separate frames instead of being copied into the packed message
+        self.zero_copy_threshold = kwargs.get('zero_copy_threshold', 1 << 16)
+        self.ssl = kwargs.get('ssl_context')
+        # permessage-deflate is negotiated with the GDS if it is "deflate" (the default of websockets), None turns it off
+        self.compression = kwargs.get('compression', "deflate")
+        # client_max_window_bits, server_max_window_bits, compress_settings (like {"level": 6}), ...
+        self.deflate_options = kwargs.get('deflate_options')
+        self.max_size = kwargs.get('max_size', 1 << 20)
+        # compresses the large attachment binaries of the EVENT messages and decompresses the downloaded ones
+        self.payload_compressor = kwargs.get('payload_compressor')
+        self.logged_in = False
+        # no console output at all if set
+        self.quiet = kwargs.get('quiet', False)
+        self.instrumentation = kwargs.get('instrumentation')
+        self.flow_control = kwargs.get('flow_control')
+        self.query_cache = kwargs.get('query_cache')
 
         self.mime_extensions = dict({
             "image/bmp": "bmp",
@@ -75,48 +312,159 @@ class GDSClient:
             "video/mp4": "mp4"
         })
 
-        if(self.url.startswith("wss") and kwargs.get('cert') and kwargs.get('secret')):
+        if(self.ssl is None and self.url.startswith("wss") and kwargs.get('cert') and kwargs.get('secret')):
             self.initTLS(kwargs.get('cert'), kwargs.get('secret'))
         self.ws = None
         self.args = kwargs
+        self.codec = kwargs.get('codec') or MessageCodec(
+            ext_hook=kwargs.get('ext_hook'), object_pairs_hook=kwargs.get('object_pairs_hook'))
+
+        # replies are routed to the awaiting request by the msgid of the header
+        self._pending = dict()
+        # ATTACHMENT_RESPONSE messages reference the ids of the requests
+        self._attachment_waiters = dict()
+        # the push subscriptions by the subscribed message types
+        self._subscriptions = dict()
+        self._reader = None
+        # buffers of the incoming fragmented messages by msgid
+        self._fragments = dict()
+        self._fragment_sizes = dict()
+
+        # the messages of the requests waiting for their replies, replayed after a reconnect
+        self._requests = dict()
+        self.reconnect = kwargs.get('reconnect', False)
+        self.reconnect_attempts = kwargs.get('reconnect_attempts', 10)
+        self.reconnect_backoff = kwargs.get('reconnect_backoff', 0.5)
+        self.reconnect_backoff_max = kwargs.get('reconnect_backoff_max', 30)
+        self.replay_types = set(kwargs.get('replay_types', [
+            DataType.QUERY_REQUEST, DataType.NEXT_QUERY_PAGE_REQUEST, DataType.ATTACHMENT_REQUEST]))
+        self._connected = None
+        # incremented by every successful reconnect, so the requests can tell whether their connection was lost
+        self._generation = 0
+        self._reconnecting = None
+        self._closing = False
 
 
     def initTLS(self, cert_path: str, password : str):
         try:
-            with open(cert_path, 'rb') as provided_cert:
-                cert_binary = provided_cert.read()
-            p12 = crypto.load_pkcs12(cert_binary, password.encode('utf8'))
-            privatekey = crypto.dump_privatekey(crypto.FILETYPE_PEM, p12.get_privatekey())
-            cert = crypto.dump_certificate(crypto.FILETYPE_PEM, p12.get_certificate())
-
-            cert_file = tempfile.NamedTemporaryFile(delete=False)
-            key_file = tempfile.NamedTemporaryFile(delete=False)
-                
-            cert_file.write(cert)
-            key_file.write(privatekey)
-            cert_file.close()
-            key_file.close()
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS)
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            ssl_context.load_cert_chain(cert_file.name, key_file.name, password)
-
-            os.unlink(cert_file.name)
-            os.unlink(key_file.name)
-
-            self.ssl = ssl_context
+            self.ssl = TLSContextCache.get(cert_path, password)
         except Exception as e:
             raise Exception("Could not initialize TLS connection!", e)
 
 
+    def log(self, *args):
+        if(not self.quiet):
+            print(*args)
+
     async def send(self, data):
-        await self.ws.send(MessageUtil.pack(data))
+        instrumentation = self.instrumentation
+        if(instrumentation is not None):
+            await instrumentation.send(self, data)
+        else:
+            await self._send_frames(data)
+
+    async def _send_frames(self, data):
+        """
+        Encodes and sends the message, returns the number of bytes sent.
+        """
+        if(self.fragment_unit is None):
+            if(isinstance(data, PreparedMessage)):
+                packed = data.packed
+            elif(MessageCodec.has_large_binaries(data, self.zero_copy_threshold)):
+                # only these messages are worth encoding into segments, it is much slower than packing the whole message
+                segments = self.__encode(data, lambda: self.codec.message_segments(data, self.zero_copy_threshold))
+                return await self.__write_segments(segments)
+            else:
+                packed = self.__encode(data, lambda: self.codec.pack(data))
+            await self.__write(packed)
+            return len(packed)
+        return await self.__send_fragmented(data)
+
+    def __encode(self, message: list, encode):
+        if(self.instrumentation is not None):
+            return self.instrumentation.pack(message, encode)
+        return encode()
+
+    async def __write(self, packed: bytes):
+        if(self.flow_control is not None):
+            await self.flow_control.consume_bytes(len(packed))
+        await self.ws.send(packed)
+
+    async def __write_segments(self, segments: list):
+        """
+        Sends the segments as the frames of one websocket message, so large binaries
+        (memory-mapped files, in-memory buffers) are not concatenated into one frame.
+        """
+        views = [segment.view() if isinstance(segment, FileContent) else segment for segment in segments]
+        views = [view for view in views if len(view)]
+        size = sum(len(view) for view in views)
+        if(self.flow_control is not None):
+            await self.flow_control.consume_bytes(size)
+        await self.ws.send(views)
+        return size
+
+    async def __send_fragmented(self, message: list):
+        header = message[:10]
+        if(MessageCodec.has_large_binaries(message, self.zero_copy_threshold)):
+            segments = self.codec.data_segments(message[10], self.zero_copy_threshold)
+        else:
+            segments = [self.codec.pack(message[10])]
+        full_data_size = sum(len(segment) for segment in segments)
+        if(full_data_size <= self.fragment_unit):
+            packed = self.codec.pack(message)
+            await self.__write(packed)
+            return len(packed)
+        header[4] = True
+        header[8] = full_data_size
+        sent = 0
+        for offset, chunk in MessageCodec.fragments(segments, self.fragment_unit):
+            header[5] = (offset == 0)
+            header[6] = (offset + len(chunk) == full_data_size)
+            header[7] = offset
+            packed = self.codec.pack_message(header, chunk)
+            await self.__write(packed)
+            sent += len(packed)
+        return sent
 
     async def recv(self):
-        data = await self.ws.recv()
-        return MessageUtil.unpack(data)
+        instrumentation = self.instrumentation
+        while True:
+            data = await self.ws.recv()
+            if(instrumentation is not None):
+                message = instrumentation.unpack(self.codec, data)
+            else:
+                message = self.codec.unpack(data)
+            if(not message[4]):
+                return message
+            message = self.__reassemble(message)
+            if(message is not None):
+                return message
+
+    def __reassemble(self, fragment: list):
+        msgid = fragment[1]
+        buffer = self._fragments.get(msgid)
+        if(buffer is None):
+            # preallocated once, the fragments are copied to their offsets
+            buffer = bytearray(fragment[8])
+            self._fragments[msgid] = buffer
+        offset = fragment[7]
+        chunk = fragment[10]
+        buffer[offset:offset + len(chunk)] = chunk
+        received = self._fragment_sizes.get(msgid, 0) + len(chunk)
+        if(received < len(buffer)):
+            self._fragment_sizes[msgid] = received
+            return None
+        self._fragments.pop(msgid)
+        self._fragment_sizes.pop(msgid, None)
+        message = fragment[:10]
+        message[4] = False
+        message.append(self.codec.unpack_data(buffer))
+        return message
 
     async def wait_for_reply(self):
+        if(self._reader is not None):
+            raise MessageException(
+                "Replies are dispatched by the reader task, use the send_... methods instead!")
         try:
             return await asyncio.wait_for(self.recv(), self.timeout)
         except asyncio.TimeoutError as e:
@@ -126,43 +474,253 @@ class GDSClient:
             raise e
 
     async def __aenter__(self):
-        self.ws = await websockets.connect(self.url, ssl=self.ssl)
+        return await self.connect()
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+    async def connect(self):
+        self._closing = False
+        self._connected = asyncio.Event()
+        await self.__open()
+        self._connected.set()
+        return self
+
+    def connect_options(self) -> dict:
+        options = dict({"ssl": self.ssl, "max_size": self.max_size})
+        if(self.compression == "deflate" and self.deflate_options):
+            from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
+            options["extensions"] = [ClientPerMessageDeflateFactory(**self.deflate_options)]
+            options["compression"] = None
+        else:
+            options["compression"] = self.compression
+        return options
+
+    async def __open(self):
+        self.logged_in = False
+        self._reader = None
+        self.ws = await websockets.connect(self.url, **self.connect_options())
         logindata = MessageUtil.create_message_from_header_and_data(
             MessageUtil.create_header(
                 DataType.CONNECTION, username=self.username),
-            MessageUtil.create_login_data(reserved=[self.password]))
-        print("Sending <login> message..")
+            MessageUtil.create_login_data(
+                fragment_support=self.fragment_unit is not None,
+                fragment_unit=self.fragment_unit,
+                reserved=[self.password]))
+        self.log("Sending <login> message..")
         await self.send(logindata)
         try:
-            print("Waiting <login> reply..")
+            self.log("Waiting <login> reply..")
             login_reply = await self.wait_for_reply()
         except TimeoutError as e:
-            print('Login message ACK timed out!')
+            self.log('Login message ACK timed out!')
             raise e
         else:
             if (self.is_ack_ok(login_reply)):
-                print("The login was successful!")
-                print(login_reply)
+                self.logged_in = True
+                self.log("The login was successful!")
+                self.log(login_reply)
             else:
-                print("Login unsuccessful!\nDetails:")
-                print("-" + str(login_reply[10][1]))
-                print("-" + str(login_reply[10][2]))
-        return self
+                self.log("Login unsuccessful!\nDetails:")
+                self.log("-" + str(login_reply[10][1]))
+                self.log("-" + str(login_reply[10][2]))
+                await self.ws.close()
+                raise MessageException(f"The login was not successful! Details: {login_reply[10][2]}")
+        self._reader = asyncio.ensure_future(self._read_loop())
 
 
-    async def __aexit__(self, exc_type, exc, tb):
-        await self.ws.close()
-        print("Client disconnected!")
-        pass
+    async def close(self):
+        self._closing = True
+        self.logged_in = False
+        for subscription in list(self._subscriptions.values()):
+            await subscription.close()
+        if(self._reconnecting is not None):
+            self._reconnecting.cancel()
+            try:
+                await self._reconnecting
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reconnecting = None
+        if(self._reader is not None):
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader = None
+        if(self.ws is not None):
+            await self.ws.close()
+        self._fail_pending(MessageException("The client was closed!"))
+        self.log("Client disconnected!")
+
+
+    def is_reconnecting(self) -> bool:
+        return self._reconnecting is not None and not self._reconnecting.done()
+
+    async def __reconnect(self, cause: Exception):
+        self.logged_in = False
+        self._fragments.clear()
+        self._fragment_sizes.clear()
+        # the requests which cannot be sent twice safely are failed right away
+        for msgid, message in list(self._requests.items()):
+            if(DATA_TYPES[message[9]] not in self.replay_types):
+                future = self._pending.pop(msgid, None)
+                if(future is not None and not future.done()):
+                    future.set_exception(ConnectionError(
+                        f"The connection was lost before the reply of the {DATA_TYPES[message[9]].name} message arrived! ({cause})"))
+        for attempt in range(self.reconnect_attempts):
+            # full jitter: a random delay up to the exponentially growing limit
+            delay = random.uniform(0, min(self.reconnect_backoff_max, self.reconnect_backoff * 2 ** attempt))
+            self.log(f"Connection lost ({cause}), reconnecting in {delay:.2f} seconds (attempt {attempt + 1})..")
+            await asyncio.sleep(delay)
+            try:
+                if(self.ws is not None):
+                    await self.ws.close()
+                await self.__open()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                cause = e
+                if(self._reader is not None):
+                    self._reader.cancel()
+                continue
+            self._generation += 1
+            self._connected.set()
+            try:
+                for msgid, message in list(self._requests.items()):
+                    if(msgid in self._pending):
+                        await self.send(message)
+            except websockets.ConnectionClosed:
+                # the reader task notices it as well and starts a new reconnect
+                return
+            self.log("Reconnected, the pending requests were sent again.")
+            return
+        self._fail_pending(ConnectionError(
+            f"Could not reconnect after {self.reconnect_attempts} attempt(s)! Last error: {cause}"))
+        self._connected.set()
+
+
+    def is_connected(self) -> bool:
+        # both the legacy and the new websockets connections have a `state` (the new ones do not have `closed`)
+        return self.logged_in and self.ws is not None and getattr(self.ws.state, 'name', None) == "OPEN" \
+            and self._reader is not None and not self._reader.done()
+
+
+    """
+    Reader task, dispatching the incoming messages
+    """
+    async def _read_loop(self):
+        try:
+            while True:
+                response = await self.recv()
+                await self._dispatch(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if(self.reconnect and not self._closing and self.logged_in):
+                self._connected.clear()
+                self._reconnecting = asyncio.ensure_future(self.__reconnect(e))
+            else:
+                self._fail_pending(e)
+
+    async def _dispatch(self, response: list):
+        message_type = DATA_TYPES[response[9]]
+        if(message_type == DataType.ATTACHMENT_RESPONSE):
+            for requestid in (AttachmentAck(response).requestids or []):
+                waiter = self._attachment_waiters.pop(requestid, None)
+                if(waiter is not None and not waiter.done()):
+                    # unsolicited responses are acknowledged by __push() (or their subscription)
+                    await self.__ack_attachment_response(response)
+                    waiter.set_result(response)
+                    break
+            else:
+                await self.__push(response)
+        elif(message_type == DataType.EVENT_DOCUMENT):
+            await self.__push(response)
+        else:
+            future = self._pending.pop(response[1], None)
+            if(future is None):
+                self.log(f"No request is waiting for the {message_type.name} message with id: {response[1]}")
+            elif(not future.done()):
+                future.set_result(response)
+
+    def _fail_pending(self, exc: Exception):
+        for waiters in (self._pending, self._attachment_waiters):
+            for future in waiters.values():
+                if(not future.done()):
+                    future.set_exception(exc)
+            waiters.clear()
+
+    async def _request(self, message: list):
+        flow_control = self.flow_control
+        if(flow_control is None):
+            return await self.__request_once(message)
+        attempt = 0
+        while True:
+            await flow_control.acquire()
+            status = None
+            try:
+                reply = await self.__request_once(message)
+                status = MessageUtil.get_status(reply)
+            except TimeoutError:
+                status = StatusCode.TIMEOUT.value
+                raise
+            finally:
+                flow_control.release(status)
+            if(status in flow_control.retry_statuses and attempt < flow_control.max_retries):
+                # throttled by the GDS, the request is queued again instead of failing
+                attempt += 1
+                await asyncio.sleep(flow_control.retry_delay(attempt))
+                continue
+            return reply
+
+    async def __request_once(self, message: list):
+        if(self.is_reconnecting()):
+            try:
+                await asyncio.wait_for(self._connected.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(
+                    f"The given timeout ({self.timeout} seconds) has passed while reconnecting to the server!")
+        if(self._reader is None or self._reader.done()):
+            raise MessageException("The client is not connected to the GDS!")
+        msgid = message[1]
+        future = asyncio.get_event_loop().create_future()
+        self._pending[msgid] = future
+        self._requests[msgid] = message
+        instrumentation = self.instrumentation
+        if(instrumentation is not None):
+            token = instrumentation.request_started(message)
+        try:
+            try:
+                await self.send(message)
+            except websockets.ConnectionClosed:
+                # replayable requests are sent again once the client reconnected
+                if(not self.reconnect or DATA_TYPES[message[9]] not in self.replay_types):
+                    raise
+            reply = await asyncio.wait_for(future, self.timeout)
+            if(instrumentation is not None):
+                instrumentation.request_finished(token, reply)
+                token = None
+            return reply
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(
+                f"The given timeout ({self.timeout} seconds) has passed without any response from the server!")
+        finally:
+            self._pending.pop(msgid, None)
+            self._requests.pop(msgid, None)
+            if(instrumentation is not None and token is not None):
+                instrumentation.request_finished(token, None)
 
 
     """
     Methods for sending data
     """
     async def send_message(self, header: list, data):
-        msg = MessageUtil.create_message_from_header_and_data(header, data)
-        await self.send(msg)
-        return msg
+        message = MessageUtil.create_message_from_header_and_data(header, data)
+        await self.send(message)
+        return message
 
 
     async def send_event2(self, **eventargs):
@@ -175,48 +733,132 @@ class GDSClient:
                 event_reply = await self.send_and_wait_message(message=eventmsg)
         elif(eventargs.get('eventstr')):
             eventdata = MessageUtil.create_event_data2(**eventargs, files=self.args.get('attachments'))
+            if(self.payload_compressor is not None):
+                eventdata[1] = await self.payload_compressor.compress_all(eventdata[1], self.instrumentation)
             eventmsg = MessageUtil.create_message_from_data(
                 DataType.EVENT, data = eventdata, username=self.args.get('username'), **eventargs)
             event_reply = await self.send_and_wait_message(message=eventmsg)
         else:
             raise ValueError(
                 "Neither the 'data' nor the 'eventstr' value were specified!")
-        return await self.check_incoming_message_type(DataType.EVENT_ACK, event_reply)
+        reply = await self.check_incoming_message_type(DataType.EVENT_ACK, event_reply)
+        if(self.query_cache is not None and self.is_ack_ok(reply, [200, 201, 202])):
+            eventstr = eventargs.get('data')[0] if eventargs.get('data') else eventargs.get('eventstr')
+            self.query_cache.invalidate_tables(QueryCache.tables(eventstr))
+        return reply
 
     async def send_attachment_request4(self, **attachargs):
         if(attachargs.get('data')):
             if(attachargs.get('header')):
-                response = await self.send_and_wait_message(header=attachargs.get('header'), data = attachargs.get('data'))
+                attachmsg = MessageUtil.create_message_from_header_and_data(attachargs.get('header'), attachargs.get('data'))
             else:
                 attachmsg = MessageUtil.create_message_from_data(
                     DataType.ATTACHMENT_REQUEST, username=self.args.get('username'), **attachargs)
-                response = await self.send_and_wait_message(message=attachmsg)
         elif(attachargs.get('attachstr')):
             attachdata = MessageUtil.create_attachment_request_data4(attachargs.get('attachstr'))
             attachmsg = MessageUtil.create_message_from_data(
                 DataType.ATTACHMENT_REQUEST, data = attachdata, username=self.args.get('username'), **attachargs)
-            response = await self.send_and_wait_message(message=attachmsg)
         else:
             raise ValueError(
                 "Neither the 'data' nor the 'attachstr' value were specified!")
-        response_body = response[10]
-        if(not self.is_ack_ok(response, [200, 201, 202])):
-            should_wait = False
-        else:
-            if(response_body[1][1].get('attachment')):
-                should_wait = False
+        reply, result = await self._request_attachment(attachmsg)
+        if(attachargs.get('sink') is not None and result is not None and result.get('attachment') is not None):
+            result['attachment'] = await self.write_attachment(result, attachargs.get('sink'))
+        return reply
+
+    async def _request_attachment(self, attachmsg: list):
+        """
+        Sends the ATTACHMENT_REQUEST message and returns its ACK, or the ATTACHMENT_RESPONSE if the ACK did not contain
+        the attachment, together with its result.
+        """
+        # the response can arrive right after the ACK, so the waiter is registered before sending
+        waiter = asyncio.get_event_loop().create_future()
+        self._attachment_waiters[attachmsg[1]] = waiter
+        try:
+            response = await self.send_and_wait_message(message=attachmsg)
+            ack = AttachmentAck(response)
+            should_wait = ack.is_ok((200, 201, 202)) and not ack.attachment
+            if(should_wait):
+                try:
+                    response = await asyncio.wait_for(waiter, self.timeout)
+                except asyncio.TimeoutError as e:
+                    raise TimeoutError(
+                        f"The given timeout ({self.timeout} seconds) has passed without any response from the server!")
+                reply = await self.check_incoming_message_type(DataType.ATTACHMENT_RESPONSE, response)
+                result = AttachmentAck(reply).result
             else:
-                should_wait = True
-        if(should_wait):
-            response = await self.wait_for_reply()
-            await self.__send_attachment_response_ack7(
-                requestids=response[10][0].get('requestids'),
-                ownertable=response[10][0].get('ownertable'),
-                attachmentid=response[10][0].get('attachmentid')
-            )
-            return await self.check_incoming_message_type(DataType.ATTACHMENT_RESPONSE, response)
+                reply = await self.check_incoming_message_type(DataType.ATTACHMENT_REQUEST_ACK, response)
+                result = ack.result if ack.is_ok((200, 201, 202)) else None
+        finally:
+            self._attachment_waiters.pop(attachmsg[1], None)
+        if(self.payload_compressor is not None and result is not None and result.get('attachment') is not None):
+            result['attachment'] = await self.payload_compressor.decompress_async(result['attachment'], self.instrumentation)
+        return reply, result
+
+    async def write_attachment(self, result: dict, sink):
+        """
+        Writes the attachment of the result to the sink (a path or a binary file-like object) in a thread pool,
+        and returns an AttachmentHandle instead of the bytes.
+        """
+        attachment = result.pop('attachment')
+        loop = asyncio.get_event_loop()
+        size, checksum = await loop.run_in_executor(None, AttachmentHandle.write, attachment, sink)
+        attachment = None
+        path = sink if isinstance(sink, (str, pathlib.PurePath)) else getattr(sink, 'name', None)
+        return AttachmentHandle(path, size, checksum, result.get('attachmentid'), result.get('meta'))
+
+    def prepare(self, message_type: DataType, **kwargs) -> 'PreparedRequest':
+        """
+        Prepares a request to be sent many times, see the PreparedRequest class. The `data` of the message can be given,
+        or the parameters of the MessageUtil.create_..._data method of the type (`eventstr`, `attachstr`, `querystr`, ...).
+        """
+        return PreparedRequest(self, message_type, **kwargs)
+
+    def subscribe(self, *message_types, **kwargs) -> 'Subscription':
+        """
+        Subscribes to the ATTACHMENT_RESPONSE and/or EVENT_DOCUMENT messages pushed by the GDS, see the Subscription class.
+        Without subscription these messages are ACKed and dropped.
+        """
+        subscription = Subscription(self, message_types or (DataType.ATTACHMENT_RESPONSE, DataType.EVENT_DOCUMENT), **kwargs)
+        for message_type in subscription.message_types:
+            if(message_type in self._subscriptions):
+                raise ValueError(f"There is a subscription to the {message_type.name} messages already!")
+        for message_type in subscription.message_types:
+            self._subscriptions[message_type] = subscription
+        return subscription
+
+    def unsubscribe(self, subscription: 'Subscription'):
+        for message_type in subscription.message_types:
+            if(self._subscriptions.get(message_type) is subscription):
+                del self._subscriptions[message_type]
+
+    async def __push(self, response: list):
+        message_type = DATA_TYPES[response[9]]
+        subscription = self._subscriptions.get(message_type)
+        if(subscription is not None):
+            await subscription.deliver(response)
+            return
+        if(message_type == DataType.ATTACHMENT_RESPONSE):
+            await self.__ack_attachment_response(response)
         else:
-            return await self.check_incoming_message_type(DataType.ATTACHMENT_REQUEST_ACK, response)
+            await self.__ack_event_document(response, username=self.args.get('username'))
+        self.log(f"Unsolicited {message_type.name} message arrived (id: {response[1]}), ACK sent.")
+
+    async def __ack_attachment_response(self, response: list):
+        await self.__send_attachment_response_ack7(
+            requestids=AttachmentAck(response).requestids,
+            ownertable=AttachmentAck(response).ownertable,
+            attachmentid=AttachmentAck(response).attachmentid
+        )
+
+    async def __ack_event_document(self, response: list, **kwargs):
+        c = len(response[10][2])
+        result = []
+        for i in range(c):
+            result.append([201, "", {}])
+        event_document_ack_data = MessageUtil.create_event_document_ack_data9(result = result)
+        message = MessageUtil.create_message_from_data(DataType.EVENT_DOCUMENT_ACK, data=event_document_ack_data, **kwargs)
+        await self.send(message)
 
     async def __send_attachment_response_ack7(self, **kwargs):
         response_ack_data = MessageUtil.create_attachment_response_ack_data7(
@@ -237,9 +879,14 @@ class GDSClient:
             event_document_data = MessageUtil.create_event_document_data8(**eventdocargs)
             msg = MessageUtil.create_message_from_data(DataType.EVENT_DOCUMENT, data=event_document_data, username = self.args.get('username'), **eventdocargs)
             event_document_reply = await self.send_and_wait_message(message=msg)
-        return await self.check_incoming_message_type(DataType.EVENT_DOCUMENT_ACK, event_document_reply)
+        reply = await self.check_incoming_message_type(DataType.EVENT_DOCUMENT_ACK, event_document_reply)
+        if(self.query_cache is not None and self.is_ack_ok(reply, [200, 201, 202])):
+            tablename = eventdocargs.get('data')[0] if eventdocargs.get('data') else eventdocargs.get('tablename')
+            self.query_cache.invalidate_tables([tablename])
+        return reply
 
     async def send_query_request10(self, **queryargs):
+        cache_key = None
         if(queryargs.get('data')):
             if(queryargs.get('header')):
                 query_reply = await self.send_and_wait_message(header=queryargs.get('header'), data = queryargs.get('data'))
@@ -248,6 +895,14 @@ class GDSClient:
                     DataType.QUERY_REQUEST, username=self.args.get('username'), **queryargs)
                 query_reply = await self.send_and_wait_message(message=querymsg)
         elif(queryargs.get('querystr')):
+            cache_key = self.__query_cache_key(**queryargs)
+            if(cache_key is not None):
+                cached = self.query_cache.get(cache_key)
+                # only complete, single page results can be answered without the GDS
+                if(cached is not None and len(cached) == 1):
+                    return cached[0], False
+                tables = QueryCache.tables(queryargs.get('querystr'))
+                generation = self.query_cache.generation(tables)
             querydata = MessageUtil.create_query_request_data10(**queryargs)
             querymsg = MessageUtil.create_message_from_data(
                 DataType.QUERY_REQUEST, data=querydata, username=self.args.get('username'), **queryargs)
@@ -256,11 +911,15 @@ class GDSClient:
             raise ValueError(
                 "Neither the 'data' nor the 'querystr' value were specified!")
         reply = await self.check_incoming_message_type(DataType.QUERY_REQUEST_ACK, query_reply)
-        if(self.is_ack_ok(reply)):
-            return reply, reply[10][1][2]
-        else:
-            return reply, None
-       
+        if(cache_key is not None and self.is_ack_ok(reply) and not QueryAck(reply).has_more_pages):
+            self.query_cache.put(cache_key, [reply], tables, generation)
+        return self.__query_result(reply, **queryargs)
+
+    def __query_cache_key(self, **queryargs):
+        if(self.query_cache is None or queryargs.get('result_mode') == "columns" or queryargs.get('no_cache')):
+            return None
+        return QueryCache.key(queryargs.get('querystr'), queryargs.get('consistency', "PAGES"), self.username)
+
     async def send_next_query_page12(self, **nextqueryargs):
         if(nextqueryargs.get('data')):
             if(nextqueryargs.get('header')):
@@ -271,7 +930,7 @@ class GDSClient:
                 next_query_reply = await self.send_and_wait_message(message=msg)
         elif(nextqueryargs.get('prev_page')):
             prev_page = nextqueryargs.get('prev_page')
-            context = prev_page[10][1][3]
+            context = QueryAck(prev_page).context
             nextquery = MessageUtil.create_next_query_page_data12(context, **nextqueryargs)
             msg = MessageUtil.create_message_from_data(
                 DataType.NEXT_QUERY_PAGE_REQUEST, data=nextquery, username=self.args.get('username'), **nextqueryargs)
@@ -280,52 +939,182 @@ class GDSClient:
             raise ValueError(
                 "Neither the 'data' nor the 'prev_page' value were specified!")
         reply = await self.check_incoming_message_type(DataType.QUERY_REQUEST_ACK, next_query_reply)
-        if(self.is_ack_ok(reply)):
-            return reply, reply[10][1][2]
+        return self.__query_result(reply, **nextqueryargs)
+
+    def __query_result(self, reply: list, **kwargs):
+        ack = QueryAck(reply)
+        if(ack.is_ok()):
+            if(kwargs.get('result_mode') == "columns"):
+                # the rows are replaced by their columns, the rest of the ack (and the paging context) stays as is
+                ack.records = QueryColumns.from_page(reply)
+            return reply, ack.has_more_pages
         else:
             return reply, None
 
 
+    async def query_pages(self, querystr: str, prefetch: int = 1, **queryargs):
+        """
+        Async generator over every page (QUERY_REQUEST_ACK message) of the query.
+        The next page is requested as soon as the previous one arrived, at most `prefetch` pages are kept waiting.
+        If the GDS rejects the query, the erroneous ACK is the last page yielded.
+        """
+        if(prefetch < 1):
+            raise ValueError("The value of 'prefetch' has to be at least 1!")
+        cache_key = self.__query_cache_key(querystr=querystr, **queryargs)
+        if(cache_key is not None):
+            cached = self.query_cache.get(cache_key)
+            if(cached is not None):
+                for page in cached:
+                    yield page
+                return
+            # the pages are collected for the cache only while they fit into it
+            collected, rows = [], 0
+            tables = QueryCache.tables(querystr)
+            generation = self.query_cache.generation(tables)
+        # the single pages are cached by the pages themselves
+        queryargs['no_cache'] = True
+        pages = asyncio.Queue(maxsize=prefetch)
+        producer = asyncio.ensure_future(self.__produce_pages(pages, querystr, **queryargs))
+        try:
+            while True:
+                page = await pages.get()
+                if(page is None):
+                    break
+                if(isinstance(page, Exception)):
+                    raise page
+                if(cache_key is not None and collected is not None):
+                    ack = QueryAck(page)
+                    if(ack.is_ok()):
+                        rows += len(ack.records)
+                    if(not ack.is_ok() or rows > self.query_cache.max_rows):
+                        collected = None
+                    else:
+                        collected.append(page)
+                yield page
+                page = None
+        finally:
+            producer.cancel()
+        if(cache_key is not None and collected):
+            self.query_cache.put(cache_key, collected, tables, generation)
+
+    async def query_all(self, querystr: str, prefetch: int = 1, **queryargs) -> list:
+        """
+        Returns the list of every page (QUERY_REQUEST_ACK message) of the query.
+        """
+        return [page async for page in self.query_pages(querystr, prefetch, **queryargs)]
+
+    async def __produce_pages(self, pages: asyncio.Queue, querystr: str, **queryargs):
+        try:
+            reply, more_page = await self._retry_on_reconnect(
+                lambda: self.send_query_request10(querystr=querystr, **queryargs))
+            while True:
+                # only the context is kept, the page itself belongs to the consumer from now on
+                context = QueryAck(reply).context if more_page else None
+                await pages.put(reply)
+                reply = None
+                if(not more_page):
+                    break
+                nextquery = MessageUtil.create_next_query_page_data12(context, **queryargs)
+                # after a reconnect the same page is requested again with the saved context
+                reply, more_page = await self._retry_on_reconnect(
+                    lambda: self.send_next_query_page12(data=nextquery, **queryargs))
+            await pages.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await pages.put(e)
+
+    async def _retry_on_reconnect(self, request):
+        """
+        Calls the request (a coroutine function) again if it failed because the connection was lost,
+        once the client reconnected.
+        """
+        attempts = 0
+        while True:
+            generation = self._generation
+            try:
+                return await request()
+            except (TimeoutError, ConnectionError, websockets.ConnectionClosed) as e:
+                attempts += 1
+                if(not self.reconnect or self._closing or attempts > self.reconnect_attempts):
+                    raise
+                # a timeout on a connection which was not lost is not retried
+                if(self._generation == generation and self._connected.is_set()):
+                    raise
+                await self._connected.wait()
+                if(self._generation == generation):
+                    # the reconnect failed
+                    raise
+
+    async def query_stream(self, querystr: str, prefetch: int = 1, **queryargs):
+        """
+        Async generator over the records of every page of the query, one record at a time.
+        """
+        async for page in self.query_pages(querystr, prefetch, **queryargs):
+            records = QueryAck(page).raise_for_status().records
+            page = None
+            for record in records:
+                yield record
+            records = None
+
+    async def export(self, querystr: str, path: str, format: str = None, prefetch: int = 1, **queryargs) -> dict:
+        """
+        Writes every page of the query into a JSONL, Parquet or Arrow file (see the QueryExporter class) and returns its stats.
+        A page is written on a worker thread while the next ones are requested.
+        """
+        exporter = QueryExporter(path, format, compression=queryargs.pop('compression', "snappy"))
+        loop = asyncio.get_event_loop()
+        try:
+            async for page in self.query_pages(querystr, prefetch, **queryargs):
+                ack = QueryAck(page).raise_for_status()
+                fielddescriptors, records = ack.fielddescriptors, ack.records
+                page = ack = None
+                await loop.run_in_executor(None, exporter.write, fielddescriptors, records)
+                records = None
+        finally:
+            exporter.close()
+        return exporter.stats()
+
+    async def query_columns(self, querystr: str, prefetch: int = 1, **queryargs):
+        """
+        Returns every page of the query concatenated into one QueryColumns object.
+        """
+        queryargs['result_mode'] = "columns"
+        pages = []
+        async for page in self.query_pages(querystr, prefetch, **queryargs):
+            pages.append(QueryAck(page).raise_for_status().records)
+            page = None
+        return QueryColumns.concat(pages)
+
+
     """
     other utilities
     """
 
     def is_ack_ok(self, response: list, ok_statuses=[200]) -> bool:
-        return (response[10] is not None) and (response[10][0] in ok_statuses)
+        return Ack(response).is_ok(ok_statuses)
 
 
     async def check_incoming_message_type(self, expected: DataType, response:list, **kwargs):
-        message_type = DataType(response[9])
+        message_type = DATA_TYPES[response[9]]
         if(message_type == expected):
             return response
         else:
-            if(message_type == DataType.ATTACHMENT_RESPONSE):
-                await self.__send_attachment_response_ack7(
-                    requestids=response[10][0].get('requestids'),
-                    ownertable=response[10][0].get('ownertable'),
-                    attachmentid=response[10][0].get('attachmentid')
-                )
-            elif(message_type == DataType.EVENT_DOCUMENT):
-                c = len(response[10][2])
-                result = []
-                for i in range(c):
-                    result.append([201, "", {}])
-                event_document_ack_data = MessageUtil.create_event_document_ack_data9(result = result)
-                message = MessageUtil.create_message_from_data(DataType.EVENT_DOCUMENT_ACK, data=event_document_ack_data, **kwargs)
-                await self.send(message)
+            if(message_type in (DataType.ATTACHMENT_RESPONSE, DataType.EVENT_DOCUMENT)):
+                await self.__push(response)
             raise MessageException(
                     f"Unexpected MessageType found for the client: {message_type.name}, message: {response}")
 
 
     async def send_and_wait_message(self, **kwargs):
         if(kwargs.get('header') and kwargs.get('data')):
-            await self.send_message(kwargs.get('header'), kwargs.get('data'))
+            message = MessageUtil.create_message_from_header_and_data(kwargs.get('header'), kwargs.get('data'))
         elif(kwargs.get('message')):
-            await self.send(kwargs.get('message'))
+            message = kwargs.get('message')
         else:
             raise ValueError(
                 "Neither the 'header' and 'data' nor the 'message' value were specified!")
-        response = await self.wait_for_reply()
+        response = await self._request(message)
         return response
 
 
@@ -340,161 +1129,2267 @@ class GDSClient:
             extension = self.mime_extensions.get(format)
 
         filepath += "." + extension
-        print(f"Saving attachment as `{filepath}`..")
+        self.log(f"Saving attachment as `{filepath}`..")
         try:
             with open(filepath, "xb") as file:
                 file.write(attachment)
-            print("Attachment successfully saved!")
+            self.log("Attachment successfully saved!")
         except Exception as e:
-            print("Saving was unsuccessful!")
+            self.log("Saving was unsuccessful!")
             raise e
 
     def save_object_to_json(self, name: str, obj: any):
         try:
             pathlib.Path("exports").mkdir(parents=True, exist_ok=True)
             filepath = f"exports/{name}.json"
-            print(f"Saving full response as `{filepath}`..")
+            self.log(f"Saving full response as `{filepath}`..")
             with open(filepath, "x") as file:
                 json.dump(obj, file, indent=4)
         except Exception as e:
-            print(f"Could not save {filepath}! Details:")
-            print(e)
+            self.log(f"Could not save {filepath}! Details:")
+            self.log(e)
 
     
     
     def print_reply(self, message: any, **kwargs):
         if kwargs.get('print_simple'):
-            print("Reply arrived!")
+            self.log("Reply arrived!")
         else:
-            print("Reply:\n: " + json.dumps(message, default=lambda x: "<" + str(sys.getsizeof(x)) + " bytes>", indent=4))
+            self.log("Reply:\n: " + json.dumps(message, default=lambda x: "<" + str(sys.getsizeof(x)) + " bytes>", indent=4))
 
     def printErrorInACK(self, message: list):
-        print(f"Error status code returned: {message[0]} ({StatusCode(message[0]).name})")
+        self.log(f"Error status code returned: {message[0]} ({StatusCode(message[0]).name})")
         if(len(message) > 2):
-            print("Error message: " + message[2])
+            self.log("Error message: " + message[2])
         else:
-            print("Server did not specify any error messages!")
+            self.log("Server did not specify any error messages!")
 
 
-class MessageUtil:
-    @staticmethod
-    def pack(data):
-        return msgpack.packb(data, use_bin_type=True)
+class Histogram:
+    """
+    Histogram with exponential buckets (powers of `factor` starting from `start`).
+    """
+    def __init__(self, start: float = 1e-6, factor: float = 2.0, buckets: int = 40):
+        self.bounds = [start * factor ** i for i in range(buckets)]
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
 
-    @staticmethod
-    def unpack(data):
-        return msgpack.unpackb(data, raw=False)
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if(self.min is None or value < self.min):
+            self.min = value
+        if(self.max is None or value > self.max):
+            self.max = value
 
-    @staticmethod
-    def create_header(header_type: DataType, **kwargs):
-        now = int(datetime.now().timestamp())
-        return [
-            kwargs.get('username', "user"),
-            kwargs.get('msgid', str(uuid.uuid4())),
-            kwargs.get('create_time', now),
-            kwargs.get('request_time', now),
-            kwargs.get('fragmented', False),
-            kwargs.get('first_fragment'),
-            kwargs.get('last_fragment'),
-            kwargs.get('offset'),
-            kwargs.get('full_data_size'),
-            header_type.value
-        ]
+    def percentile(self, p: float) -> float:
+        """
+        The upper bound of the bucket the `p` percentile (between 0 and 1) falls into.
+        """
+        if(self.count == 0):
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if(seen >= rank and count):
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
 
-    @staticmethod
-    def create_message_from_header_and_data(header: list, data: list):
-        msg = [] + header
-        msg.append(data)
-        return msg
+    def snapshot(self) -> dict:
+        return dict({
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": (self.sum / self.count) if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99)
+        })
 
-    @staticmethod
-    def create_login_data(**kwargs):
-        return [
-            kwargs.get('serve_on_same', False),
-            #current GDS version is 5.1, therefore
-            #the major version is set to 5 while the minor to 1.
-            kwargs.get('version', (5 << 16 | 1)),
-            kwargs.get('fragment_support', False),
-            kwargs.get('fragment_unit', None),
-            kwargs.get('reserved', [None])
-        ]
 
+class _NoSpan:
+    def __enter__(self):
+        return self
 
-    @staticmethod
-    def create_event_data2(**kwargs):
-        binary_contents = kwargs.get('binary_contents', {})
-        if(kwargs.get('files')):
-            for fname in kwargs.get('files').split(';'):
-                try:
-                    with open("attachments/" + fname, "rb") as file:
-                        hexname = MessageUtil.hex(fname)
-                        binary_contents[hexname] = file.read()
-                except Exception as e:
-                    raise FileNotFoundError(
-                        f"The file named '{fname}' does not exist or could not be opened!")
+    def __exit__(self, exc_type, exc, tb):
+        return False
 
-        return [
-            kwargs.get('eventstr'),
-            binary_contents,
-            kwargs.get('priority_levels', [])
-        ]
 
-    @staticmethod
-    def create_attachment_request_data4(attstr: str):
-        return attstr
+class Instrumentation:
+    """
+    Collects the metrics of the clients it is given to (by the `instrumentation` parameter), labeled by the DataType
+    and StatusCode names: latency of the requests, of the encoding and decoding, frame sizes, in-flight requests and
+    the status codes of the replies.
+    The `callbacks` are called with the name of the event (`send`, `recv`, `request`) and its attributes,
+    the `tracer` can be an OpenTelemetry tracer (anything with a `start_as_current_span(name, attributes=...)` method).
+    """
+    def __init__(self, callbacks: list = None, tracer=None):
+        self.callbacks = list(callbacks or [])
+        self.tracer = tracer
+        self.histograms = dict()
+        self.counters = dict()
+        self.in_flight = dict()
 
-    @staticmethod
-    def create_attachment_response_ack_data7(**kwargs):
-        return [
-            kwargs.get('globalstatus', 200),
-            [
-                kwargs.get('localstatus', 201),
-                dict({
-                    "requestids": kwargs.get('requestids'),
-                    "ownertable": kwargs.get('ownertable'),
-                    "attachmentid": kwargs.get('attachmentid')
-                })
-            ],
-            None
-        ]
+    def observe(self, metric: str, label: str, value: float, **kwargs):
+        key = (metric, label)
+        histogram = self.histograms.get(key)
+        if(histogram is None):
+            histogram = Histogram(**kwargs)
+            self.histograms[key] = histogram
+        histogram.observe(value)
 
+    def increment(self, metric: str, label: str, value: int = 1):
+        key = (metric, label)
+        self.counters[key] = self.counters.get(key, 0) + value
 
-    @staticmethod
-    def create_event_document_data8(**kwargs):
-        return [
-            kwargs.get('tablename'),
-            kwargs.get('fielddescriptors'),
-            kwargs.get('records'),
-            kwargs.get('returningoptions', dict({}))
-        ]
+    def span(self, name: str, **attributes):
+        if(self.tracer is None):
+            return _NoSpan()
+        return self.tracer.start_as_current_span(name, attributes=attributes)
 
+    def emit(self, event: str, **attributes):
+        for callback in self.callbacks:
+            callback(event, attributes)
 
-    @staticmethod
-    def create_event_document_ack_data9(**kwargs):
-        return [
-            kwargs.get('globalstatus', 200),
-            kwargs.get('result'),
-            None
-        ]
+    async def send(self, client: GDSClient, message: list):
+        label = DATA_TYPES[message[9]].name
+        with self.span("gds.send", message_type=label, msgid=message[1]):
+            started = time.perf_counter()
+            size = await client._send_frames(message)
+            elapsed = time.perf_counter() - started
+        self.observe("send_seconds", label, elapsed)
+        self.observe("frame_bytes_sent", label, size, start=16)
+        self.emit("send", message_type=label, msgid=message[1], size=size, seconds=elapsed)
 
-    @staticmethod
-    def create_query_request_data10(**kwargs):
-        return [
-            kwargs.get('querystr'),
-            kwargs.get('consistency', "PAGES"),
-            kwargs.get('timeout', 60000)
-        ]
+    def unpack(self, codec: 'MessageCodec', data):
+        with self.span("gds.unpack", size=len(data)):
+            started = time.perf_counter()
+            message = codec.unpack(data)
+            elapsed = time.perf_counter() - started
+        label = DATA_TYPES[message[9]].name
+        self.observe("unpack_seconds", label, elapsed)
+        self.observe("frame_bytes_received", label, len(data), start=16)
+        self.emit("recv", message_type=label, msgid=message[1], size=len(data), seconds=elapsed)
+        return message
 
-    @staticmethod
-    def create_next_query_page_data12(context: list, **kwargs):
-        return [
-            context,
-            kwargs.get('timeout', 60000)
-        ]
+    def pack(self, message: list, encode):
+        """
+        Times the encoding of the message, `encode()` returns its bytes (or segments).
+        """
+        label = DATA_TYPES[message[9]].name
+        with self.span("gds.pack", message_type=label):
+            started = time.perf_counter()
+            packed = encode()
+            elapsed = time.perf_counter() - started
+        self.observe("pack_seconds", label, elapsed)
+        return packed
 
-    @staticmethod
-    def create_message_from_data(header_type: DataType, **kwargs):
-        return MessageUtil.create_message_from_header_and_data(MessageUtil.create_header(header_type, **kwargs), kwargs.get('data'))
+    def request_started(self, message: list):
+        label = DATA_TYPES[message[9]].name
+        self.in_flight[label] = self.in_flight.get(label, 0) + 1
+        self.observe("in_flight", label, sum(self.in_flight.values()), start=1)
+        return (label, time.perf_counter())
+
+    def request_finished(self, token: tuple, reply):
+        label, started = token
+        elapsed = time.perf_counter() - started
+        self.in_flight[label] -= 1
+        code = MessageUtil.get_status(reply) if reply is not None else None
+        if(reply is None):
+            status = "NO_REPLY"
+        elif(code is None):
+            status = "UNKNOWN"
+        else:
+            try:
+                status = StatusCode(code).name
+            except ValueError:
+                status = str(code)
+        self.observe("request_seconds", label, elapsed)
+        self.increment("status", f"{label}:{status}")
+        self.emit("request", message_type=label, status=status, seconds=elapsed)
+
+    def snapshot(self) -> dict:
+        histograms = dict()
+        for (metric, label), histogram in self.histograms.items():
+            histograms.setdefault(metric, dict())[label] = histogram.snapshot()
+        counters = dict()
+        for (metric, label), value in self.counters.items():
+            counters.setdefault(metric, dict())[label] = value
+        return dict({
+            "histograms": histograms,
+            "counters": counters,
+            "in_flight": dict(self.in_flight)
+        })
+
+
+class TokenBucket:
+    """
+    Allows `rate` tokens per second on average with bursts of at most `capacity` tokens.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        if(rate <= 0):
+            raise ValueError("The rate of the token bucket has to be positive!")
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount: float = 1):
+        self.__refill()
+        # amounts larger than the capacity are allowed, the bucket goes into debt
+        self.tokens -= amount
+        if(self.tokens < 0):
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def limits(self) -> dict:
+        self.__refill()
+        return dict({"rate": self.rate, "capacity": self.capacity, "tokens": self.tokens})
+
+
+class FlowController:
+    """
+    Client side flow control: an AIMD in-flight window and optional token buckets for messages/sec and bytes/sec.
+    The window grows by `increase` per window of successful replies, and is multiplied by `decrease_factor` when the
+    GDS answers with one of the `throttle_statuses` (408, 429 and 509 by default). Throttled requests are retried
+    after a backoff, at most `max_retries` times, the others wait for a free slot in the window instead of failing.
+    """
+    def __init__(self, **kwargs):
+        self.min_window = kwargs.get('min_window', 1)
+        self.max_window = kwargs.get('max_window', 1024)
+        self.window = float(kwargs.get('initial_window', 16))
+        self.increase = kwargs.get('increase', 1.0)
+        self.decrease_factor = kwargs.get('decrease_factor', 0.5)
+        self.throttle_statuses = set(kwargs.get('throttle_statuses', [
+            StatusCode.TIMEOUT.value, StatusCode.TOO_MANY_REQUESTS.value, StatusCode.BANDWIDTH_LIMIT_EXCEEDED.value]))
+        self.retry_statuses = set(kwargs.get('retry_statuses', [
+            StatusCode.TOO_MANY_REQUESTS.value, StatusCode.BANDWIDTH_LIMIT_EXCEEDED.value]))
+        self.max_retries = kwargs.get('max_retries', 5)
+        self.retry_backoff = kwargs.get('retry_backoff', 0.1)
+        self.retry_backoff_max = kwargs.get('retry_backoff_max', 10)
+        self.message_bucket = TokenBucket(kwargs.get('messages_per_sec'), kwargs.get('message_burst')) \
+            if kwargs.get('messages_per_sec') else None
+        self.byte_bucket = TokenBucket(kwargs.get('bytes_per_sec'), kwargs.get('byte_burst')) \
+            if kwargs.get('bytes_per_sec') else None
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttled = 0
+        self._condition = None
+
+    async def acquire(self):
+        if(self._condition is None):
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            self.waiting += 1
+            try:
+                while(self.in_flight >= int(self.window)):
+                    await self._condition.wait()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+        if(self.message_bucket is not None):
+            await self.message_bucket.consume()
+
+    def release(self, status: int = None):
+        self.in_flight -= 1
+        if(status in self.throttle_statuses):
+            self.throttled += 1
+            self.window = max(self.min_window, self.window * self.decrease_factor)
+        elif(status is not None):
+            self.window = min(self.max_window, self.window + self.increase / self.window)
+        if(self._condition is not None):
+            asyncio.ensure_future(self.__notify())
+
+    async def __notify(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def consume_bytes(self, size: int):
+        if(self.byte_bucket is not None):
+            await self.byte_bucket.consume(size)
+
+    def retry_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+
+    def limits(self) -> dict:
+        return dict({
+            "window": int(self.window),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "throttled": self.throttled,
+            "messages": self.message_bucket.limits() if self.message_bucket is not None else None,
+            "bytes": self.byte_bucket.limits() if self.byte_bucket is not None else None
+        })
+
+
+class QueryCache:
+    """
+    LRU cache of complete query results (the list of their pages), keyed by the normalized query string,
+    the consistency and the user. At most `max_entries` queries with `max_rows` records in total are kept,
+    for at most `ttl` seconds each. Successful EVENT and EVENT_DOCUMENT messages invalidate the entries of the
+    tables they modify, and the results of the queries which were running meanwhile are not cached.
+    """
+    TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+("[^"]+"|[\w.@-]+)', re.IGNORECASE)
+
+    def __init__(self, max_entries: int = 256, max_rows: int = 100000, ttl: float = 60):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # incremented by every invalidation of the table
+        self.generations = dict()
+
+    @staticmethod
+    def key(querystr: str, consistency: str, username: str) -> tuple:
+        return (QueryCache.normalize(querystr), consistency, username)
+
+    @staticmethod
+    def normalize(querystr: str) -> str:
+        """
+        Collapses the whitespaces outside of quotes and strips the trailing semicolon.
+        """
+        parts = re.split(r"""('[^']*'|"[^"]*")""", querystr.strip().rstrip(';'))
+        return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+    @staticmethod
+    def tables(sql: str) -> set:
+        return set(QueryCache.table_name(name) for name in QueryCache.TABLE_PATTERN.findall(sql or ""))
+
+    @staticmethod
+    def table_name(name: str) -> str:
+        return name.strip('"').lower()
+
+    def get(self, key: tuple):
+        entry = self.entries.get(key)
+        if(entry is not None and entry[0] < time.monotonic()):
+            self.__remove(key)
+            entry = None
+        if(entry is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def generation(self, tables) -> tuple:
+        """
+        The state of the tables, read before the query is sent and given to put() with its result.
+        """
+        return tuple(self.generations.get(table, 0) for table in sorted(tables))
+
+    def put(self, key: tuple, pages: list, tables: set, generation: tuple = None):
+        if(generation is not None and generation != self.generation(tables)):
+            # a table was modified while the query was running, the result may be stale
+            return
+        rows = sum(len(QueryAck(page).records) for page in pages)
+        if(rows > self.max_rows):
+            return
+        if(key in self.entries):
+            self.__remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, pages, rows, set(tables))
+        self.rows += rows
+        while(len(self.entries) > self.max_entries or self.rows > self.max_rows):
+            self.__remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate_tables(self, tables):
+        tables = set(QueryCache.table_name(table) for table in tables if table)
+        for table in tables:
+            self.generations[table] = self.generations.get(table, 0) + 1
+        for key in [key for key, entry in self.entries.items() if entry[3] & tables]:
+            self.__remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.rows = 0
+
+    def __remove(self, key: tuple):
+        entry = self.entries.pop(key)
+        self.rows -= entry[2]
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return dict({
+            "entries": len(self.entries),
+            "rows": self.rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / requests) if requests else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        })
+
+
+class ShardedQuery:
+    """
+    Splits one query into range predicates on the `key` field, by the given `boundaries` (N+1 values for N shards,
+    the first and the last can be None for open ranges), runs the shards at the same time over the connections of a
+    GDSClientPool (or a list of GDSClients) and merges their records. With `ordered` the shards are ordered by the key
+    and merged in key order. At most `limit` records are returned, once it is reached the other shards are cancelled.
+    Use it with `async for record in ShardedQuery(...)`.
+    """
+    def __init__(self, clients, querystr: str, key: str, boundaries: list, ordered: bool = False, descending: bool = False,
+            limit: int = None, prefetch: int = 1, buffer: int = 1000, **queryargs):
+        if(len(boundaries) < 2):
+            raise ValueError("At least two boundaries are needed for the shards!")
+        self.clients = clients
+        self.querystr = querystr
+        self.key = key
+        self.boundaries = boundaries
+        self.ordered = ordered
+        self.descending = descending
+        # the LIMIT of the query limits the merged records, not the records of every shard
+        own_limit = ShardedQuery.query_limit(querystr)
+        self.limit = own_limit if limit is None else (limit if own_limit is None else min(limit, own_limit))
+        self.prefetch = prefetch
+        self.buffer = buffer
+        self.queryargs = queryargs
+        self.shard_rows = [0] * (len(boundaries) - 1)
+        self.queries = [self.shard_query(i) for i in range(len(boundaries) - 1)]
+
+    @staticmethod
+    def ranges(low, high, shards: int) -> list:
+        """
+        Boundaries splitting the numeric [low, high] range into `shards` equal ranges.
+        """
+        step = (high - low) / shards
+        boundaries = [low + step * i for i in range(shards)] + [high]
+        if(isinstance(low, int) and isinstance(high, int)):
+            boundaries = [int(boundary) for boundary in boundaries]
+        return boundaries
+
+    @staticmethod
+    def event_id_ranges(start: datetime, end: datetime, shards: int, prefix: str = "EVNT") -> list:
+        """
+        Boundaries splitting the [start, end] time range into `shards` ranges of ids in the `EVNTyyMMddHHmmssSSS0` format.
+        """
+        step = (end - start) / shards
+        moments = [start + step * i for i in range(shards)] + [end]
+        return [prefix + moment.strftime("%y%m%d%H%M%S") + f"{moment.microsecond // 1000:03d}0" for moment in moments]
+
+    @staticmethod
+    def literal(value) -> str:
+        if(isinstance(value, str)):
+            return "'" + value.replace("'", "''") + "'"
+        return str(value)
+
+    def shard_query(self, index: int) -> str:
+        low, high = self.boundaries[index], self.boundaries[index + 1]
+        last = index == len(self.boundaries) - 2
+        conditions = []
+        if(low is not None):
+            conditions.append(f"{self.key} >= {ShardedQuery.literal(low)}")
+        if(high is not None):
+            conditions.append(f"{self.key} {'<=' if last else '<'} {ShardedQuery.literal(high)}")
+        predicate = " AND ".join(conditions) or "1 = 1"
+        head, tail = ShardedQuery.split_tail(self.querystr.strip().rstrip(';'))
+        where = ShardedQuery.find_keyword(head, "WHERE")
+        if(where < 0):
+            head = f"{head} WHERE {predicate}"
+        else:
+            head = f"{head[:where]}WHERE ({head[where + 5:].strip()}) AND {predicate}"
+        position = ShardedQuery.find_keyword(tail, "LIMIT")
+        if(position >= 0):
+            # replaced by the limit of the merged records below
+            tail = tail[:position].rstrip()
+        if(ShardedQuery.find_keyword(tail, "ORDER BY") >= 0):
+            if(self.ordered):
+                raise ValueError("The ordered merge orders the records by the key, the query cannot have its own ORDER BY clause!")
+            raise ValueError("The shards are merged in the order their records arrive, the ORDER BY clause of the query would be lost! "
+                "Use the ordered merge (by the key) instead.")
+        if(self.ordered):
+            # after the GROUP BY (and HAVING) clause
+            tail += f" ORDER BY {self.key} {'DESC' if self.descending else 'ASC'}"
+        if(self.limit is not None):
+            tail += f" LIMIT {self.limit}"
+        return head + tail
+
+    @staticmethod
+    def query_limit(querystr: str):
+        """
+        The value of the LIMIT clause of the query, None if it has none.
+        """
+        querystr = querystr.strip().rstrip(';')
+        position = ShardedQuery.find_keyword(querystr, "LIMIT")
+        if(position < 0):
+            return None
+        match = re.fullmatch(r"LIMIT\s+(\d+)\s*", querystr[position:], re.IGNORECASE)
+        if(match is None):
+            raise ValueError("Only a 'LIMIT n' clause (without an offset) can be used in sharded queries!")
+        return int(match.group(1))
+
+    @staticmethod
+    def split_tail(querystr: str):
+        """
+        Splits the query before its GROUP BY, ORDER BY or LIMIT clause.
+        """
+        positions = [position for position in (ShardedQuery.find_keyword(querystr, keyword)
+            for keyword in ("GROUP BY", "ORDER BY", "LIMIT")) if position >= 0]
+        if(not positions):
+            return querystr, ""
+        position = min(positions)
+        return querystr[:position].rstrip(), " " + querystr[position:]
+
+    @staticmethod
+    def find_keyword(querystr: str, keyword: str) -> int:
+        """
+        The position of the (last) keyword outside of quotes and parentheses, -1 if it is not found.
+        """
+        pattern = re.compile(r"\b" + keyword.replace(" ", r"\s+") + r"\b", re.IGNORECASE)
+        found = -1
+        quote = None
+        depth = 0
+        for i, char in enumerate(querystr):
+            if(quote is not None):
+                if(char == quote):
+                    quote = None
+                continue
+            if(char == "'" or char == '"'):
+                quote = char
+            elif(char == '('):
+                depth += 1
+            elif(char == ')'):
+                depth -= 1
+            elif(depth == 0 and pattern.match(querystr, i) and (i == 0 or not (querystr[i - 1].isalnum() or querystr[i - 1] == '_'))):
+                found = i
+        return found
+
+    def __aiter__(self):
+        return self.records()
+
+    async def records(self):
+        queues = [asyncio.Queue(maxsize=self.buffer) for query in self.queries]
+        tasks = [asyncio.ensure_future(self.__run_shard(i, queues[i])) for i in range(len(self.queries))]
+        returned = 0
+        try:
+            async for record in (self.__merge_ordered(queues) if self.ordered else self.__merge(queues)):
+                yield record
+                returned += 1
+                if(self.limit is not None and returned >= self.limit):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def __run_shard(self, index: int, records: asyncio.Queue):
+        try:
+            if(isinstance(self.clients, GDSClientPool)):
+                async with self.clients.lease() as client:
+                    await self.__stream_shard(client, index, records)
+            else:
+                await self.__stream_shard(self.clients[index % len(self.clients)], index, records)
+            await records.put(ShardedQuery.__DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await records.put(e)
+
+    async def __stream_shard(self, client: GDSClient, index: int, records: asyncio.Queue):
+        key_index = None
+        async for page in client.query_pages(self.queries[index], self.prefetch, **self.queryargs):
+            ack = QueryAck(page)
+            if(not ack.is_ok()):
+                raise MessageException(
+                    f"Shard #{index} was not successful! Status: {ack.status}, details: {ack.error}")
+            if(key_index is None):
+                names = [descriptor[0] for descriptor in ack.fielddescriptors]
+                key_index = names.index(self.key) if self.key in names else -1
+                if(self.ordered and key_index < 0):
+                    raise MessageException(f"The '{self.key}' field has to be selected for the ordered merge!")
+            rows = ack.records
+            page = ack = None
+            for row in rows:
+                self.shard_rows[index] += 1
+                await records.put((key_index, row))
+
+    __DONE = object()
+
+    async def __merge(self, queues: list):
+        # the rows of every shard are forwarded into one queue in the order they arrive
+        merged = asyncio.Queue(maxsize=self.buffer)
+        running = len(queues)
+
+        async def forward(records: asyncio.Queue):
+            while True:
+                item = await records.get()
+                await merged.put(item)
+                if(item is ShardedQuery.__DONE or isinstance(item, Exception)):
+                    return
+
+        forwarders = [asyncio.ensure_future(forward(records)) for records in queues]
+        try:
+            while(running):
+                item = await merged.get()
+                if(item is ShardedQuery.__DONE):
+                    running -= 1
+                elif(isinstance(item, Exception)):
+                    raise item
+                else:
+                    yield item[1]
+        finally:
+            for forwarder in forwarders:
+                forwarder.cancel()
+
+    async def __merge_ordered(self, queues: list):
+        heap = []
+        sequence = 0
+
+        async def push(index: int):
+            nonlocal sequence
+            item = await queues[index].get()
+            if(item is ShardedQuery.__DONE):
+                return
+            if(isinstance(item, Exception)):
+                raise item
+            value = item[1][item[0]]
+            # the null values come last, in both directions
+            sortkey = (value is None, _Descending(value) if self.descending else value)
+            heapq.heappush(heap, (sortkey, index, sequence, item[1]))
+            sequence += 1
+
+        await asyncio.gather(*[push(index) for index in range(len(queues))])
+        while(heap):
+            sortkey, index, seq, row = heapq.heappop(heap)
+            yield row
+            await push(index)
+
+
+class _Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class PooledConnection:
+    def __init__(self, index: int, client: GDSClient):
+        self.index = index
+        self.client = client
+        self.in_flight = 0
+        self.leases = 0
+        self.reconnects = 0
+        self.busy_time = 0.0
+        self.busy_since = None
+        self.created = time.monotonic()
+
+    def is_healthy(self) -> bool:
+        return self.client.is_connected()
+
+    def stats(self) -> dict:
+        busy_time = self.busy_time
+        if(self.busy_since is not None):
+            busy_time += time.monotonic() - self.busy_since
+        uptime = time.monotonic() - self.created
+        return dict({
+            "index": self.index,
+            "healthy": self.is_healthy(),
+            "in_flight": self.in_flight,
+            "leases": self.leases,
+            "reconnects": self.reconnects,
+            "busy_ratio": (busy_time / uptime) if uptime > 0 else 0.0
+        })
+
+
+class GDSClientPool:
+    """
+    Keeps `size` logged-in GDSClient connections open and hands them out as leases.
+    Every other keyword argument is passed to the GDSClient constructor.
+    """
+    def __init__(self, size: int = 4, max_in_flight: int = 16, health_check_interval: float = 10,
+            acquire_timeout: float = 30, **kwargs):
+        if(size < 1 or max_in_flight < 1):
+            raise ValueError("The size and the max_in_flight values of the pool have to be positive!")
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.args = kwargs
+        self.connections = []
+        self._next = 0
+        self._condition = None
+        self._health_checker = None
+
+        self.lease_count = 0
+        self.lease_wait_total = 0.0
+        self.lease_wait_max = 0.0
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        self._condition = asyncio.Condition()
+        args = dict(self.args)
+        # the connections share the SSL context
+        if(args.get('ssl_context') is None and args.get('url', "").startswith("wss") and args.get('cert') and args.get('secret')):
+            args['ssl_context'] = TLSContextCache.get(args.get('cert'), args.get('secret'))
+        self.args = args
+        self.connections = [PooledConnection(i, GDSClient(**self.args)) for i in range(self.size)]
+        try:
+            await asyncio.gather(*[connection.client.connect() for connection in self.connections])
+        except BaseException:
+            await asyncio.gather(*[connection.client.close() for connection in self.connections], return_exceptions=True)
+            raise
+        if(self.health_check_interval):
+            self._health_checker = asyncio.ensure_future(self._health_check_loop())
+        return self
+
+    async def close(self):
+        if(self._health_checker is not None):
+            self._health_checker.cancel()
+            try:
+                await self._health_checker
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._health_checker = None
+        await asyncio.gather(*[connection.client.close() for connection in self.connections], return_exceptions=True)
+
+    def lease(self):
+        return PoolLease(self)
+
+    async def acquire(self) -> PooledConnection:
+        started = time.monotonic()
+        async with self._condition:
+            connection = self._select()
+            while(connection is None):
+                remaining = None
+                if(self.acquire_timeout is not None):
+                    remaining = self.acquire_timeout - (time.monotonic() - started)
+                    if(remaining <= 0):
+                        raise TimeoutError(f"No healthy pooled connection was available in {self.acquire_timeout} seconds!")
+                try:
+                    await asyncio.wait_for(self._condition.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                connection = self._select()
+            if(connection.in_flight == 0):
+                connection.busy_since = time.monotonic()
+            connection.in_flight += 1
+            connection.leases += 1
+        waited = time.monotonic() - started
+        self.lease_count += 1
+        self.lease_wait_total += waited
+        self.lease_wait_max = max(self.lease_wait_max, waited)
+        return connection
+
+    async def release(self, connection: PooledConnection):
+        async with self._condition:
+            connection.in_flight -= 1
+            if(connection.in_flight == 0 and connection.busy_since is not None):
+                connection.busy_time += time.monotonic() - connection.busy_since
+                connection.busy_since = None
+            self._condition.notify_all()
+
+    def _select(self):
+        # least loaded healthy connection, ties are broken round-robin
+        selected = None
+        for i in range(len(self.connections)):
+            connection = self.connections[(self._next + i) % len(self.connections)]
+            if(not connection.is_healthy() or connection.in_flight >= self.max_in_flight):
+                continue
+            if(selected is None or connection.in_flight < selected.in_flight):
+                selected = connection
+        if(selected is not None):
+            self._next = (selected.index + 1) % len(self.connections)
+        return selected
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await asyncio.gather(*[self._check(connection) for connection in self.connections], return_exceptions=True)
+
+    async def _check(self, connection: PooledConnection):
+        if(connection.client.is_reconnecting()):
+            return
+        if(connection.is_healthy()):
+            try:
+                pong = await connection.client.ws.ping()
+                await asyncio.wait_for(pong, connection.client.timeout)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+        if(connection.in_flight > 0 and connection.is_healthy()):
+            return
+        await connection.client.close()
+        try:
+            await connection.client.connect()
+            connection.reconnects += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            connection.client.log(f"Could not reconnect the pooled connection #{connection.index}! Details: {e}")
+        async with self._condition:
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return dict({
+            "leases": self.lease_count,
+            "lease_wait_avg": (self.lease_wait_total / self.lease_count) if self.lease_count else 0.0,
+            "lease_wait_max": self.lease_wait_max,
+            "connections": [connection.stats() for connection in self.connections]
+        })
+
+
+class PoolLease:
+    def __init__(self, pool: GDSClientPool):
+        self.pool = pool
+        self.connection = None
+
+    async def __aenter__(self) -> GDSClient:
+        self.connection = await self.pool.acquire()
+        return self.connection.client
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.pool.release(self.connection)
+        self.connection = None
+
+
+class SyncGDSClient:
+    """
+    A thread-safe, blocking client for synchronous code. It runs a GDSClientPool of `size` connections on an event loop
+    of its own background thread, so any number of threads can share these connections.
+    Every request method has a `..._future` variant, which returns a concurrent.futures.Future instead of waiting.
+    Every other keyword argument is passed to the GDSClientPool (and the GDSClient) constructor.
+    """
+    def __init__(self, size: int = 2, max_in_flight: int = 64, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.pool = None
+        self._thread = threading.Thread(target=self.__run_loop, name="gds-client-loop", daemon=True)
+        self._thread.start()
+        try:
+            self.pool = self.__call(self.__open_pool(size, max_in_flight, **kwargs))
+        except Exception:
+            self.__stop_loop()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def __stop_loop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    async def __open_pool(self, size: int, max_in_flight: int, **kwargs) -> GDSClientPool:
+        return await GDSClientPool(size=size, max_in_flight=max_in_flight, **kwargs).open()
+
+    def __call(self, coroutine):
+        if(threading.current_thread() is self._thread):
+            raise RuntimeError("The blocking methods cannot be called from the loop of the client, use the async GDSClient instead!")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def submit(self, function, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Runs `await function(client, *args, **kwargs)` with a leased GDSClient on the loop of the client.
+        """
+        if(self.pool is None or not self.loop.is_running()):
+            raise MessageException("The client is closed!")
+        return asyncio.run_coroutine_threadsafe(self.__leased(function, *args, **kwargs), self.loop)
+
+    async def __leased(self, function, *args, **kwargs):
+        async with self.pool.lease() as client:
+            return await function(client, *args, **kwargs)
+
+    def event_future(self, eventstr: str = None, **eventargs) -> concurrent.futures.Future:
+        return self.submit(SyncGDSClient.__event, eventstr, **eventargs)
+
+    def event(self, eventstr: str = None, **eventargs) -> list:
+        return self.event_future(eventstr, **eventargs).result()
+
+    def query_future(self, querystr: str = None, **queryargs) -> concurrent.futures.Future:
+        return self.submit(SyncGDSClient.__query, querystr, **queryargs)
+
+    def query(self, querystr: str = None, **queryargs) -> tuple:
+        """
+        Returns the first page (the QUERY_REQUEST_ACK) and the has_more_page value.
+        """
+        return self.query_future(querystr, **queryargs).result()
+
+    def query_all_future(self, querystr: str, **queryargs) -> concurrent.futures.Future:
+        return self.submit(SyncGDSClient.__query_all, querystr, **queryargs)
+
+    def query_all(self, querystr: str, **queryargs) -> list:
+        return self.query_all_future(querystr, **queryargs).result()
+
+    def attachment_future(self, attachstr: str = None, **attachargs) -> concurrent.futures.Future:
+        return self.submit(SyncGDSClient.__attachment, attachstr, **attachargs)
+
+    def attachment(self, attachstr: str = None, **attachargs) -> list:
+        return self.attachment_future(attachstr, **attachargs).result()
+
+    @staticmethod
+    async def __event(client: GDSClient, eventstr: str, **eventargs):
+        if(eventstr is not None):
+            eventargs['eventstr'] = eventstr
+        return await client.send_event2(**eventargs)
+
+    @staticmethod
+    async def __query(client: GDSClient, querystr: str, **queryargs):
+        if(querystr is not None):
+            queryargs['querystr'] = querystr
+        return await client.send_query_request10(**queryargs)
+
+    @staticmethod
+    async def __query_all(client: GDSClient, querystr: str, **queryargs):
+        return await client.query_all(querystr, **queryargs)
+
+    @staticmethod
+    async def __attachment(client: GDSClient, attachstr: str, **attachargs):
+        if(attachstr is not None):
+            attachargs['attachstr'] = attachstr
+        return await client.send_attachment_request4(**attachargs)
+
+    def stats(self) -> dict:
+        return self.__call(self.__stats())
+
+    async def __stats(self) -> dict:
+        return self.pool.stats()
+
+    def close(self):
+        if(self.pool is None):
+            return
+        try:
+            self.__call(self.pool.close())
+        finally:
+            self.pool = None
+            self.__stop_loop()
+
+
+class Subscription:
+    """
+    Receives the ATTACHMENT_RESPONSE and EVENT_DOCUMENT messages pushed by the GDS. The messages are given to the
+    `handler` coroutine one by one, or (without a handler) they can be consumed by `async for`.
+    At most `max_buffer` messages are buffered, if the buffer is full the new messages are dropped and ACKed with 429.
+    The ACKs are collected and sent together when `ack_batch` of them are ready, or `ack_linger` seconds after the first one.
+    """
+    def __init__(self, client: GDSClient, message_types, handler=None, max_buffer: int = 1000,
+            ack_batch: int = 1, ack_linger: float = 0.05, auto_ack: bool = True):
+        self.client = client
+        self.message_types = set(message_types)
+        for message_type in self.message_types:
+            if(message_type not in (DataType.ATTACHMENT_RESPONSE, DataType.EVENT_DOCUMENT)):
+                raise ValueError(f"Only ATTACHMENT_RESPONSE and EVENT_DOCUMENT messages can be subscribed to, not {message_type.name}!")
+        self.handler = handler
+        self.ack_batch = ack_batch
+        self.ack_linger = ack_linger
+        # without a handler the messages are ACKed when they are taken from the buffer, unless this is False
+        self.auto_ack = auto_ack
+        self.received = 0
+        self.acked = 0
+        self.dropped = 0
+        self.closed = False
+        self._queue = asyncio.Queue(max_buffer)
+        self._acks = []
+        self._linger_handle = None
+        self._flushes = set()
+        self._worker = asyncio.ensure_future(self.__run()) if handler is not None else None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if(self.closed and self._queue.empty()):
+            raise StopAsyncIteration
+        message = await self._queue.get()
+        if(message is None):
+            raise StopAsyncIteration
+        if(self.auto_ack):
+            self.ack(message)
+        return message
+
+    async def deliver(self, message: list):
+        self.received += 1
+        try:
+            # the reader of the client must not wait for the consumer, it would block the replies of the requests as well
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.client.log(f"The buffer of the subscription is full, the {DATA_TYPES[message[9]].name} message (id: {message[1]}) is dropped.")
+            self.ack(message, status=StatusCode.TOO_MANY_REQUESTS.value, error="The buffer of the subscription is full!")
+
+    async def __run(self):
+        while True:
+            message = await self._queue.get()
+            if(message is None):
+                return
+            try:
+                await self.handler(message)
+                self.ack(message)
+            except Exception as e:
+                self.client.log(f"The handler of the {DATA_TYPES[message[9]].name} message (id: {message[1]}) failed: {e}")
+                self.ack(message, status=StatusCode.BAD_REQUEST.value, error=str(e))
+
+    def ack(self, message: list, status: int = 201, error: str = ""):
+        """
+        Queues the ACK of the pushed message, with the given local status.
+        """
+        self._acks.append(Subscription.ack_message(message, status, error, username=self.client.args.get('username')))
+        if(len(self._acks) >= self.ack_batch):
+            self.flush()
+        elif(self._linger_handle is None):
+            self._linger_handle = asyncio.get_event_loop().call_later(self.ack_linger, self.flush)
+
+    @staticmethod
+    def ack_message(message: list, status: int = 201, error: str = "", **kwargs) -> list:
+        if(DATA_TYPES[message[9]] == DataType.EVENT_DOCUMENT):
+            result = [[status, error, dict({})] for record in (message[10][2] or [])]
+            data = MessageUtil.create_event_document_ack_data9(result=result)
+            return MessageUtil.create_message_from_data(DataType.EVENT_DOCUMENT_ACK, data=data, msgid=message[1], **kwargs)
+        response = message[10][0]
+        data = MessageUtil.create_attachment_response_ack_data7(
+            localstatus=status,
+            requestids=response.get('requestids'),
+            ownertable=response.get('ownertable'),
+            attachmentid=response.get('attachmentid'))
+        return MessageUtil.create_message_from_data(DataType.ATTACHMENT_RESPONSE_ACK, data=data, msgid=message[1], **kwargs)
+
+    def flush(self):
+        if(self._linger_handle is not None):
+            self._linger_handle.cancel()
+            self._linger_handle = None
+        if(not self._acks):
+            return
+        acks = self._acks
+        self._acks = []
+        task = asyncio.ensure_future(self.__send_acks(acks))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def __send_acks(self, acks: list):
+        for message in acks:
+            try:
+                await self.client.send(message)
+                self.acked += 1
+            except Exception as e:
+                self.client.log(f"The ACK of the message (id: {message[1]}) could not be sent: {e}")
+
+    async def close(self):
+        """
+        Unsubscribes, waits for the handler to process the buffered messages and sends the remaining ACKs.
+        """
+        if(self.closed):
+            return
+        self.closed = True
+        self.client.unsubscribe(self)
+        if(self._worker is not None):
+            await self._queue.put(None)
+            await self._worker
+        else:
+            try:
+                # wakes up the waiting consumer, the buffered messages can still be consumed
+                self._queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+        self.flush()
+        if(self._flushes):
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return dict({
+            "received": self.received,
+            "acked": self.acked,
+            "dropped": self.dropped,
+            "buffered": self._queue.qsize()
+        })
+
+
+class PreparedMessage(list):
+    """
+    A message of a PreparedRequest, which carries its already encoded form as well.
+    """
+    __slots__ = ('packed',)
+
+
+class PreparedRequest:
+    """
+    A request created by GDSClient.prepare(...), which can be sent many times. The data and the constant fields of
+    the header are encoded only once, every send encodes just the new msgid and the timestamps.
+    The msgids come from a counter, prefixed by a random value generated once per process.
+    """
+    _msgid_prefix = uuid.uuid4().hex[:16]
+    _msgid_counter = itertools.count()
+
+    def __init__(self, client: GDSClient, message_type: DataType, data=None, **kwargs):
+        if(data is None):
+            data = PreparedRequest.create_data(message_type, **kwargs)
+        self.client = client
+        self.message_type = message_type
+        self.ack_type = DataType(message_type.value + 1)
+        self.data = data
+        self.username = kwargs.get('username', client.args.get('username', "user"))
+        header = MessageUtil.create_header(message_type, username=self.username)
+        # the msgid and the timestamps come between these two parts
+        self._head = client.codec.pack_fields([self.username], array_length=len(header) + 1)
+        self._tail = client.codec.pack_fields(header[4:] + [data])
+        self.tables = None
+        if(message_type == DataType.EVENT):
+            self.tables = QueryCache.tables(data[0])
+        elif(message_type == DataType.EVENT_DOCUMENT):
+            self.tables = [data[0]]
+
+    @staticmethod
+    def create_data(message_type: DataType, **kwargs):
+        if(message_type == DataType.EVENT):
+            return MessageUtil.create_event_data2(**kwargs)
+        if(message_type == DataType.ATTACHMENT_REQUEST):
+            return MessageUtil.create_attachment_request_data4(kwargs.get('attachstr'))
+        if(message_type == DataType.EVENT_DOCUMENT):
+            return MessageUtil.create_event_document_data8(**kwargs)
+        if(message_type == DataType.QUERY_REQUEST):
+            return MessageUtil.create_query_request_data10(**kwargs)
+        raise ValueError(f"The {message_type.name} messages cannot be prepared without their 'data'!")
+
+    @staticmethod
+    def next_msgid() -> str:
+        return f"{PreparedRequest._msgid_prefix}{next(PreparedRequest._msgid_counter):x}"
+
+    def message(self) -> PreparedMessage:
+        msgid = PreparedRequest.next_msgid()
+        now = int(time.time())
+        message = PreparedMessage([self.username, msgid, now, now, False, None, None, None, None, self.message_type.value, self.data])
+        message.packed = self._head + self.client.codec.pack_fields([msgid, now, now]) + self._tail
+        return message
+
+    async def send(self) -> list:
+        """
+        Sends the request with a new msgid and returns its reply.
+        """
+        client = self.client
+        if(self.message_type == DataType.ATTACHMENT_REQUEST):
+            # the attachment may arrive in a separate ATTACHMENT_RESPONSE
+            reply, result = await client._request_attachment(self.message())
+            return reply
+        reply = await client.send_and_wait_message(message=self.message())
+        reply = await client.check_incoming_message_type(self.ack_type, reply)
+        if(self.tables and client.query_cache is not None and client.is_ack_ok(reply, [200, 201, 202])):
+            client.query_cache.invalidate_tables(self.tables)
+        return reply
+
+
+class EventBatcher:
+    """
+    Collects EVENT statements and sends them together as one EVENT message. A batch is sent when it reaches
+    `max_statements` statements or `max_bytes` bytes, or `linger` seconds after its first statement arrived.
+    Every caller gets back the results belonging to its own statements from the EVENT_ACK.
+    """
+    def __init__(self, client: GDSClient, max_statements: int = 100, max_bytes: int = 1 << 20, linger: float = 0.005):
+        self.client = client
+        self.max_statements = max_statements
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self._batch = []
+        self._statements = 0
+        self._bytes = 0
+        self._linger_handle = None
+        self._flushes = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def submit(self, eventstr: str, binary_contents: dict = None, priority_levels: list = None) -> asyncio.Future:
+        count = len(MessageUtil.split_statements(eventstr))
+        if(count == 0):
+            raise ValueError("The 'eventstr' does not contain any statements!")
+        future = asyncio.get_event_loop().create_future()
+        self._batch.append((eventstr, binary_contents or {}, priority_levels or [], count, future))
+        self._statements += count
+        self._bytes += len(eventstr.encode()) + sum(len(content) for content in (binary_contents or {}).values())
+        if(self._statements >= self.max_statements or self._bytes >= self.max_bytes):
+            self.flush()
+        elif(self._linger_handle is None):
+            self._linger_handle = asyncio.get_event_loop().call_later(self.linger, self.flush)
+        return future
+
+    async def send(self, eventstr: str, binary_contents: dict = None, priority_levels: list = None) -> list:
+        return await self.submit(eventstr, binary_contents, priority_levels)
+
+    def flush(self):
+        if(self._linger_handle is not None):
+            self._linger_handle.cancel()
+            self._linger_handle = None
+        if(not self._batch):
+            return
+        batch = self._batch
+        self._batch = []
+        self._statements = 0
+        self._bytes = 0
+        task = asyncio.ensure_future(self.__send_batch(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def close(self):
+        self.flush()
+        if(self._flushes):
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def __send_batch(self, batch: list):
+        try:
+            eventstr, binary_contents, priority_levels = EventBatcher.merge(batch)
+            data = MessageUtil.create_event_data2(
+                eventstr=eventstr, binary_contents=binary_contents, priority_levels=priority_levels)
+            reply = await self.client.send_event2(data=data)
+        except Exception as e:
+            for item in batch:
+                if(not item[4].done()):
+                    item[4].set_exception(e)
+            return
+        ack = EventAck(reply)
+        if(not ack.is_ok((200, 201, 202))):
+            exception = MessageException(
+                f"The batched event was not successful! Status: {ack.status}, details: {ack.error}")
+            for item in batch:
+                if(not item[4].done()):
+                    item[4].set_exception(exception)
+            return
+        results = ack.results
+        position = 0
+        for item in batch:
+            count = item[3]
+            if(not item[4].done()):
+                item[4].set_result(results[position:position + count])
+            position += count
+
+    @staticmethod
+    def merge(batch: list):
+        statements = []
+        binary_contents = dict()
+        priority_levels = []
+        base = 0
+        for eventstr, contents, levels, count, future in batch:
+            statements.append(eventstr.strip().rstrip(';'))
+            for key, value in contents.items():
+                if(key in binary_contents and binary_contents[key] is not value and binary_contents[key] != value):
+                    raise ValueError(f"Different binary contents were given with the same id: '{key}'!")
+                binary_contents[key] = value
+            # the operation indexes of the priority levels are shifted by the statements before them
+            for i, level in enumerate(levels):
+                while(len(priority_levels) <= i):
+                    priority_levels.append([])
+                for entry in level:
+                    priority_levels[i].append(dict({index + base: value for index, value in entry.items()}))
+            base += count
+        return ";".join(statements), binary_contents, priority_levels
+
+
+class BulkLoadReport:
+    def __init__(self):
+        self.records = 0
+        self.batches = 0
+        self.status_counts = dict()
+        # (batch index, record index within the batch, status code, message) of the unsuccessful records
+        self.failures = []
+        self.elapsed = 0.0
+
+    def add(self, batch_index: int, statuses: list):
+        self.batches += 1
+        for index, (status, message) in enumerate(statuses):
+            self.records += 1
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if(status not in (200, 201, 202)):
+                self.failures.append((batch_index, index, status, message))
+
+    @property
+    def records_per_sec(self) -> float:
+        return (self.records / self.elapsed) if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return f"BulkLoadReport({self.records} record(s) in {self.batches} batch(es), statuses: {self.status_counts}, " \
+            f"{len(self.failures)} failure(s), {self.records_per_sec:.1f} records/sec)"
+
+
+class BulkLoader:
+    """
+    Loads a large record source with EVENT_DOCUMENT messages using several worker processes.
+    Every worker logs in with its own connection (the other keyword arguments are passed to the GDSClient)
+    and converts, packs and sends the batches it takes from a bounded queue.
+    """
+    def __init__(self, workers: int = None, batch_size: int = 1000, in_flight: int = 2, queue_size: int = None, **kwargs):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.in_flight = in_flight
+        # the reader blocks if the workers fall behind
+        self.queue_size = queue_size or 2 * self.workers * in_flight
+        self.args = kwargs
+
+    def load(self, source, tablename: str, fielddescriptors: list = None, returningoptions: dict = None, progress=None) -> BulkLoadReport:
+        """
+        `source` is the path of a CSV (with a header row) or a JSONL file or an iterable of records (lists).
+        For JSONL files and iterables the `fielddescriptors` have to be specified,
+        for CSV files they default to KEYWORD fields named by the header row.
+        `progress` is called with the number of records sent so far and the report whenever a batch is answered.
+        """
+        from multiprocessing import Process, Value, Queue
+        started = time.monotonic()
+        source_format, batches, fielddescriptors = self.__open_source(source, fielddescriptors)
+        tasks = Queue(maxsize=self.queue_size)
+        results = Queue()
+        sent = Value('l', 0)
+        processes = [Process(target=_bulk_load_worker, daemon=True, args=(
+            self.args, tablename, fielddescriptors, returningoptions or dict({}), source_format, self.in_flight, tasks, results, sent))
+            for i in range(self.workers)]
+        for process in processes:
+            process.start()
+        report = BulkLoadReport()
+        try:
+            count = 0
+            for batch in batches:
+                self.__put(tasks, (count, batch), processes)
+                count += 1
+                while(not results.empty()):
+                    self.__collect(results.get(), report, sent, progress)
+            # one sentinel for every sender of every worker
+            for i in range(self.workers * self.in_flight):
+                self.__put(tasks, None, processes)
+            while(report.batches < count):
+                try:
+                    self.__collect(results.get(timeout=1), report, sent, progress)
+                except queue.Empty:
+                    if(not any(process.is_alive() for process in processes)):
+                        raise MessageException(
+                            f"Every bulk load worker stopped, {count - report.batches} batch(es) remained unanswered!")
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+                if(process.is_alive()):
+                    process.terminate()
+        report.elapsed = time.monotonic() - started
+        return report
+
+    def __put(self, tasks, item, processes: list):
+        while True:
+            try:
+                tasks.put(item, timeout=1)
+                return
+            except queue.Full:
+                if(not any(process.is_alive() for process in processes)):
+                    raise MessageException("Every bulk load worker stopped!")
+
+    def __collect(self, result: tuple, report: BulkLoadReport, sent, progress):
+        batch_index, statuses, error = result
+        if(error is not None and not self.args.get('quiet')):
+            print(f"Batch #{batch_index} could not be loaded! Details: {error}")
+        report.add(batch_index, statuses)
+        if(progress is not None):
+            progress(sent.value, report)
+
+    def __open_source(self, source, fielddescriptors: list):
+        if(isinstance(source, (str, pathlib.PurePath))):
+            path = str(source)
+            if(path.lower().endswith(".csv")):
+                file = open(path, newline='')
+                rows = csv.reader(file)
+                header = next(rows)
+                if(fielddescriptors is None):
+                    fielddescriptors = [[name, "KEYWORD", "text/plain"] for name in header]
+                return "csv", self.__batches(rows, file), fielddescriptors
+            if(fielddescriptors is None):
+                raise ValueError("The 'fielddescriptors' have to be specified for JSONL sources!")
+            file = open(path)
+            lines = (line for line in file if line.strip())
+            return "jsonl", self.__batches(lines, file), fielddescriptors
+        if(fielddescriptors is None):
+            raise ValueError("The 'fielddescriptors' have to be specified for record iterators!")
+        return "records", self.__batches(iter(source)), fielddescriptors
+
+    def __batches(self, items, file=None):
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if(len(batch) >= self.batch_size):
+                    yield batch
+                    batch = []
+            if(batch):
+                yield batch
+        finally:
+            if(file is not None):
+                file.close()
+
+    @staticmethod
+    def convert(source_format: str, batch: list, fielddescriptors: list) -> list:
+        if(source_format == "records"):
+            return batch
+        if(source_format == "jsonl"):
+            names = [descriptor[0] for descriptor in fielddescriptors]
+            records = []
+            for line in batch:
+                record = json.loads(line)
+                if(isinstance(record, dict)):
+                    record = [record.get(name) for name in names]
+                records.append(record)
+            return records
+        converters = [BulkLoader.CSV_CONVERTERS.get(descriptor[1]) for descriptor in fielddescriptors]
+        return [[None if value == "" else (converter(value) if converter else value)
+            for value, converter in zip(row, converters)] for row in batch]
+
+    CSV_CONVERTERS = dict({
+        "BOOLEAN": lambda value: value.strip().lower() in ("true", "1", "yes"),
+        "INTEGER": int,
+        "LONG": int,
+        "DOUBLE": float
+    })
+
+
+def _bulk_load_worker(client_args: dict, tablename: str, fielddescriptors: list, returningoptions: dict,
+        source_format: str, in_flight: int, tasks, results, sent):
+    async def send_batches(client: GDSClient):
+        loop = asyncio.get_event_loop()
+        while True:
+            task = await loop.run_in_executor(None, tasks.get)
+            if(task is None):
+                return
+            batch_index, batch = task
+            size = len(batch)
+            statuses, error = [], None
+            try:
+                records = BulkLoader.convert(source_format, batch, fielddescriptors)
+                batch = None
+                reply = await client.send_event_document8(tablename=tablename, fielddescriptors=fielddescriptors,
+                    records=records, returningoptions=returningoptions)
+                records = None
+                ack = EventAck(reply)
+                if(ack.is_ok((200, 201, 202))):
+                    statuses = [(result[0], result[1] if len(result) > 1 else None) for result in ack.results]
+                else:
+                    error = f"Status: {ack.status}, details: {ack.error}"
+                    statuses = [(ack.status, ack.error)] * size
+                with sent.get_lock():
+                    sent.value += size
+            except Exception as e:
+                error = repr(e)
+                statuses = [(None, error)] * size
+            results.put((batch_index, statuses, error))
+
+    async def run():
+        async with GDSClient(**client_args) as client:
+            await asyncio.gather(*[send_batches(client) for i in range(in_flight)])
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+class AttachmentHandle:
+    """
+    Describes an attachment written to a file (or file-like object) instead of the attachment bytes.
+    """
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path, size: int, checksum: str, attachmentid: str = None, meta: str = None):
+        self.path = path
+        self.size = size
+        self.checksum = checksum
+        self.attachmentid = attachmentid
+        self.meta = meta
+
+    def __repr__(self):
+        return f"AttachmentHandle(path={self.path!r}, size={self.size}, sha256={self.checksum})"
+
+    @staticmethod
+    def write(attachment, sink):
+        checksum = hashlib.sha256()
+        view = memoryview(attachment)
+        if(isinstance(sink, (str, pathlib.PurePath))):
+            with open(sink, "xb") as file:
+                AttachmentHandle.__write_chunks(view, file, checksum)
+        else:
+            AttachmentHandle.__write_chunks(view, sink, checksum)
+        return len(view), checksum.hexdigest()
+
+    @staticmethod
+    def __write_chunks(view: memoryview, file, checksum):
+        for offset in range(0, len(view), AttachmentHandle.CHUNK_SIZE):
+            chunk = view[offset:offset + AttachmentHandle.CHUNK_SIZE]
+            checksum.update(chunk)
+            file.write(chunk)
+
+
+class QueryColumns:
+    """
+    The records of query pages stored by columns. Numeric and boolean fields are NumPy arrays
+    (masked arrays if the column has null values), every other field is stored in an object array.
+    """
+    NUMPY_TYPES = dict({
+        "BOOLEAN": "bool",
+        "INTEGER": "int32",
+        "LONG": "int64",
+        "DOUBLE": "float64"
+    })
+
+    def __init__(self, fielddescriptors: list, columns: dict, size: int):
+        self.fielddescriptors = fielddescriptors
+        self.columns = columns
+        self.size = size
+
+    @property
+    def names(self) -> list:
+        return [descriptor[0] for descriptor in self.fielddescriptors]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def __repr__(self):
+        return f"QueryColumns({self.size} record(s), columns: {self.names})"
+
+    @staticmethod
+    def from_page(reply: list):
+        if(optional_module("numpy") is None):
+            raise ImportError("The columnar result mode requires the `numpy` module! (pip install numpy)")
+        ack = QueryAck(reply)
+        fielddescriptors = ack.fielddescriptors
+        records = ack.records
+        size = len(records)
+        if(size):
+            values = list(zip(*records))
+        else:
+            values = [()] * len(fielddescriptors)
+        columns = dict()
+        for descriptor, column in zip(fielddescriptors, values):
+            columns[descriptor[0]] = QueryColumns.to_array(column, descriptor[1])
+        return QueryColumns(fielddescriptors, columns, size)
+
+    @staticmethod
+    def to_array(values, fieldtype: str):
+        numpy = optional_module("numpy")
+        dtype = QueryColumns.NUMPY_TYPES.get(fieldtype)
+        if(dtype is not None):
+            if(None in values):
+                mask = [value is None for value in values]
+                return numpy.ma.masked_array([0 if value is None else value for value in values], mask=mask, dtype=dtype)
+            return numpy.array(values, dtype=dtype)
+        array = numpy.empty(len(values), dtype=object)
+        try:
+            array[:] = values
+        except ValueError:
+            # lists of the same length would be broadcast as a second dimension
+            for i, value in enumerate(values):
+                array[i] = value
+        return array
+
+    @staticmethod
+    def concat(pages: list):
+        if(not pages):
+            raise ValueError("At least one page is needed for the concatenation!")
+        numpy = optional_module("numpy")
+        fielddescriptors = pages[0].fielddescriptors
+        columns = dict()
+        for name in pages[0].names:
+            parts = [page.columns[name] for page in pages]
+            if(any(isinstance(part, numpy.ma.MaskedArray) for part in parts)):
+                columns[name] = numpy.ma.concatenate(parts)
+            else:
+                columns[name] = numpy.concatenate(parts)
+        return QueryColumns(fielddescriptors, columns, sum(page.size for page in pages))
+
+
+class QueryExporter:
+    """
+    Writes the pages of a query into a JSONL, Parquet or Arrow (IPC) file as they arrive.
+    Every page becomes one row group (record batch), typed by the field descriptors of the first page.
+    The format is chosen by the extension of the file if it is not given.
+    """
+    FORMATS = dict({
+        ".jsonl": "jsonl",
+        ".ndjson": "jsonl",
+        ".parquet": "parquet",
+        ".arrow": "arrow",
+        ".feather": "arrow"
+    })
+
+    ARROW_TYPES = dict({
+        "BOOLEAN": "bool_",
+        "INTEGER": "int32",
+        "LONG": "int64",
+        "DOUBLE": "float64",
+        "KEYWORD": "string",
+        "TEXT": "string",
+        "BINARY": "binary"
+    })
+
+    def __init__(self, path: str, format: str = None, compression: str = "snappy"):
+        self.path = path
+        self.format = format or QueryExporter.FORMATS.get(pathlib.Path(path).suffix.lower())
+        if(self.format not in ("jsonl", "parquet", "arrow")):
+            raise ValueError(f"Unknown export format of '{path}'! Choose from: jsonl, parquet, arrow")
+        if(self.format != "jsonl" and optional_module("pyarrow") is None):
+            raise ImportError(f"The {self.format} export requires the `pyarrow` module! (pip install pyarrow)")
+        self.compression = compression
+        self.rows = 0
+        self.pages = 0
+        self.fielddescriptors = None
+        self._file = None
+        self._writer = None
+        self._schema = None
+
+    def __open(self, fielddescriptors: list):
+        pyarrow = optional_module("pyarrow")
+        self.fielddescriptors = fielddescriptors
+        directory = os.path.dirname(self.path)
+        if(directory):
+            pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+        if(self.format == "jsonl"):
+            self._file = open(self.path, "w", encoding="utf-8")
+            return
+        self._schema = pyarrow.schema([(descriptor[0], QueryExporter.arrow_type(descriptor[1])) for descriptor in fielddescriptors])
+        if(self.format == "parquet"):
+            optional_module("pyarrow.parquet")
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, self._schema, compression=self.compression)
+        else:
+            optional_module("pyarrow.ipc")
+            self._file = pyarrow.OSFile(self.path, "wb")
+            self._writer = pyarrow.ipc.new_file(self._file, self._schema)
+
+    def write(self, fielddescriptors: list, records: list):
+        """
+        Writes the records of one page.
+        """
+        if(self.fielddescriptors is None):
+            self.__open(fielddescriptors)
+        if(self.format == "jsonl"):
+            names = [descriptor[0] for descriptor in self.fielddescriptors]
+            self._file.writelines(json.dumps(dict(zip(names, record)), separators=(',', ':'),
+                ensure_ascii=False, default=QueryExporter.json_default) + "\n" for record in records)
+        elif(records):
+            pyarrow = optional_module("pyarrow")
+            arrays = []
+            for i, field in enumerate(self._schema):
+                values = [record[i] for record in records]
+                if(pyarrow.types.is_string(field.type)):
+                    values = [QueryExporter.text(value) for value in values]
+                arrays.append(pyarrow.array(values, type=field.type))
+            self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+        self.rows += len(records)
+        self.pages += 1
+
+    def close(self):
+        if(self._writer is not None):
+            self._writer.close()
+            self._writer = None
+        if(self._file is not None):
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict:
+        return dict({
+            "path": self.path,
+            "format": self.format,
+            "rows": self.rows,
+            "pages": self.pages
+        })
+
+    @staticmethod
+    def arrow_type(fieldtype: str):
+        pyarrow = optional_module("pyarrow")
+        if(fieldtype.endswith("_ARRAY")):
+            return pyarrow.list_(QueryExporter.arrow_type(fieldtype[:-len("_ARRAY")]))
+        if(fieldtype == "STRING_MAP"):
+            return pyarrow.map_(pyarrow.string(), pyarrow.string())
+        # the values of the unknown types are stored as JSON strings
+        return getattr(pyarrow, QueryExporter.ARROW_TYPES.get(fieldtype, "string"))()
+
+    @staticmethod
+    def text(value):
+        if(value is None or isinstance(value, str)):
+            return value
+        return json.dumps(value, separators=(',', ':'), default=QueryExporter.json_default)
+
+    @staticmethod
+    def json_default(obj):
+        if(isinstance(obj, (bytes, bytearray, memoryview))):
+            return base64.b64encode(obj).decode("ascii")
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class PayloadCompressor:
+    """
+    Compresses the attachment binaries of at least `threshold` bytes with zstd (`zstandard` module) or lz4 (`lz4` module)
+    on a worker thread. The GDS stores the compressed binaries, so every reader of these attachments has to use
+    a compressor as well: the downloaded attachments starting with the frame header of the algorithm are decompressed.
+    A zstd `dictionary` (bytes, trained for example by `zstandard.train_dictionary`) helps with small, similar binaries.
+    """
+    ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+    LZ4_MAGIC = b"\x04\x22\x4d\x18"
+
+    def __init__(self, algorithm: str = "zstd", level: int = 3, threshold: int = 1 << 16, dictionary: bytes = None):
+        if(algorithm == "zstd" and optional_module("zstandard") is None):
+            raise ImportError("The zstd compression requires the `zstandard` module! (pip install zstandard)")
+        if(algorithm == "lz4" and optional_module("lz4.frame") is None):
+            raise ImportError("The lz4 compression requires the `lz4` module! (pip install lz4)")
+        if(algorithm not in ("zstd", "lz4")):
+            raise ValueError(f"Unknown compression algorithm: '{algorithm}'! Choose from: zstd, lz4")
+        if(dictionary is not None and algorithm != "zstd"):
+            raise ValueError("Only the zstd compression supports dictionaries!")
+        self.algorithm = algorithm
+        self.level = level
+        self.threshold = threshold
+        self.magic = PayloadCompressor.ZSTD_MAGIC if algorithm == "zstd" else PayloadCompressor.LZ4_MAGIC
+        self.dictionary = optional_module("zstandard").ZstdCompressionDict(dictionary) if dictionary is not None else None
+        # the zstd (de)compressors are not thread-safe, every worker thread gets its own ones
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compressed = 0
+        self.decompressed = 0
+
+    def compress(self, data) -> bytes:
+        if(isinstance(data, FileContent)):
+            data = data.view()
+        if(self.algorithm == "zstd"):
+            compressor = getattr(self._local, 'compressor', None)
+            if(compressor is None):
+                compressor = optional_module("zstandard").ZstdCompressor(level=self.level, dict_data=self.dictionary)
+                self._local.compressor = compressor
+            compressed = compressor.compress(data)
+        else:
+            compressed = optional_module("lz4.frame").compress(data, compression_level=self.level)
+        with self._lock:
+            self.bytes_in += len(data)
+            self.bytes_out += len(compressed)
+            self.compressed += 1
+        return compressed
+
+    def decompress(self, data: bytes) -> bytes:
+        if(not self.is_compressed(data)):
+            return data
+        if(self.algorithm == "zstd"):
+            decompressor = getattr(self._local, 'decompressor', None)
+            if(decompressor is None):
+                decompressor = optional_module("zstandard").ZstdDecompressor(dict_data=self.dictionary)
+                self._local.decompressor = decompressor
+            # the compressed frames contain the size of the content
+            decompressed = decompressor.decompress(data)
+        else:
+            decompressed = optional_module("lz4.frame").decompress(data)
+        with self._lock:
+            self.decompressed += 1
+        return decompressed
+
+    def is_compressed(self, data) -> bool:
+        return isinstance(data, (bytes, bytearray)) and bytes(data[:4]) == self.magic
+
+    async def compress_all(self, binary_contents: dict, instrumentation=None) -> dict:
+        """
+        Returns a copy of the binary contents, the values of at least `threshold` bytes compressed on worker threads.
+        The compressed value is kept only if it is smaller than the original.
+        """
+        if(not binary_contents):
+            return binary_contents
+        loop = asyncio.get_event_loop()
+        contents = dict(binary_contents)
+        keys = [key for key, value in contents.items() if len(value) >= self.threshold]
+        compressed = await asyncio.gather(*[loop.run_in_executor(None, self.compress, contents[key]) for key in keys])
+        for key, value in zip(keys, compressed):
+            size = len(contents[key])
+            if(len(value) < size):
+                contents[key] = value
+                if(instrumentation is not None):
+                    instrumentation.increment("compression_saved_bytes", self.algorithm, size - len(value))
+        return contents
+
+    async def decompress_async(self, data, instrumentation=None):
+        if(not self.is_compressed(data)):
+            return data
+        decompressed = await asyncio.get_event_loop().run_in_executor(None, self.decompress, data)
+        if(instrumentation is not None):
+            instrumentation.increment("decompressed_bytes", self.algorithm, len(decompressed))
+        return decompressed
+
+    def stats(self) -> dict:
+        return dict({
+            "algorithm": self.algorithm,
+            "compressed": self.compressed,
+            "decompressed": self.decompressed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "saved_bytes": self.bytes_in - self.bytes_out,
+            "ratio": (self.bytes_out / self.bytes_in) if self.bytes_in else 1.0
+        })
+
+
+class TLSContextCache:
+    """
+    Process-wide cache of the SSL contexts created from PKCS12 files, keyed by the path, the modification time
+    and the size of the file and the hash of the password. The certificate and the key are loaded from memory
+    (an anonymous memfd file on Linux), they are written into temporary files only if that is not supported.
+    """
+    _contexts = dict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def key(cert_path: str, password: str) -> tuple:
+        path = os.path.abspath(cert_path)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size, hashlib.sha256(password.encode('utf8')).hexdigest())
+
+    @staticmethod
+    def get(cert_path: str, password: str) -> ssl.SSLContext:
+        key = TLSContextCache.key(cert_path, password)
+        with TLSContextCache._lock:
+            context = TLSContextCache._contexts.get(key)
+            if(context is None):
+                context = TLSContextCache.create(cert_path, password)
+                TLSContextCache._contexts[key] = context
+            return context
+
+    @staticmethod
+    def create(cert_path: str, password: str) -> ssl.SSLContext:
+        from OpenSSL import crypto
+        with open(cert_path, 'rb') as provided_cert:
+            cert_binary = provided_cert.read()
+        p12 = crypto.load_pkcs12(cert_binary, password.encode('utf8'))
+        privatekey = crypto.dump_privatekey(crypto.FILETYPE_PEM, p12.get_privatekey())
+        cert = crypto.dump_certificate(crypto.FILETYPE_PEM, p12.get_certificate())
+
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS)
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+        TLSContextCache.load_cert_chain(ssl_context, cert + privatekey)
+        return ssl_context
+
+    @staticmethod
+    def load_cert_chain(ssl_context: ssl.SSLContext, pem: bytes):
+        if(hasattr(os, 'memfd_create') and os.path.isdir("/proc/self/fd")):
+            fd = os.memfd_create("gds-cert", getattr(os, 'MFD_CLOEXEC', 0))
+            try:
+                os.write(fd, pem)
+                ssl_context.load_cert_chain(f"/proc/self/fd/{fd}")
+                return
+            finally:
+                os.close(fd)
+        pem_file = tempfile.NamedTemporaryFile(delete=False)
+        try:
+            pem_file.write(pem)
+            pem_file.close()
+            ssl_context.load_cert_chain(pem_file.name)
+        finally:
+            os.unlink(pem_file.name)
+
+    @staticmethod
+    def clear():
+        with TLSContextCache._lock:
+            TLSContextCache._contexts.clear()
+
+
+class FileContent:
+    """
+    A binary content of a file, memory-mapped only when its message is sent.
+    The packer gets a memoryview of the mapping, so the file is not copied into the memory first,
+    and fragmented messages slice it chunk by chunk.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self):
+        return f"FileContent({self.path!r}, {self.size} bytes)"
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def view(self) -> memoryview:
+        if(self.size == 0):
+            return memoryview(b"")
+        with open(self.path, "rb") as file:
+            # the mapping keeps its own file descriptor, it is released together with the last view
+            mapping = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_READ)
+        if(hasattr(mapping, 'madvise')):
+            mapping.madvise(mmap.MADV_SEQUENTIAL)
+        return memoryview(mapping)
+
+    def chunks(self, chunk_size: int):
+        view = self.view()
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+
+
+class MessageCodec:
+    """
+    Reusable msgpack encoder/decoder of a connection.
+    The packer is created once and reused for every frame, every frame is decoded on its own
+    (a websocket message is always complete, and a broken frame cannot affect the next ones).
+    `ext_hook` and `object_pairs_hook` are passed to msgpack.unpackb().
+    """
+    def __init__(self, **kwargs):
+        self._packer = msgpack.Packer(use_bin_type=True, autoreset=False, default=MessageCodec.default)
+        unpack_options = dict({"raw": False})
+        if(kwargs.get('ext_hook') is not None):
+            unpack_options["ext_hook"] = kwargs.get('ext_hook')
+        if(kwargs.get('object_pairs_hook') is not None):
+            unpack_options["object_pairs_hook"] = kwargs.get('object_pairs_hook')
+        self.unpack_options = unpack_options
+
+    def pack(self, data) -> bytes:
+        packer = self._packer
+        packer.pack(data)
+        return self.__flush()
+
+    def pack_fields(self, fields: list, array_length: int = None) -> bytes:
+        """
+        Encodes the fields one after the other, preceded by an array header if `array_length` is given.
+        """
+        packer = self._packer
+        if(array_length is not None):
+            packer.pack_array_header(array_length)
+        for field in fields:
+            packer.pack(field)
+        return self.__flush()
+
+    def pack_message(self, header: list, data) -> bytes:
+        """
+        Encodes the header fields and the data as one message without concatenating them into a new list.
+        """
+        packer = self._packer
+        packer.pack_array_header(len(header) + 1)
+        for field in header:
+            packer.pack(field)
+        packer.pack(data)
+        return self.__flush()
+
+    def unpack(self, data):
+        try:
+            return msgpack.unpackb(data, **self.unpack_options)
+        except ValueError as e:
+            raise MessageException(f"The received frame does not contain exactly one valid message! Details: {e}")
+
+    def unpack_data(self, buffer):
+        """
+        Decodes one complete object (for example the data part of a reassembled message) from the buffer.
+        """
+        return msgpack.unpackb(buffer, **self.unpack_options)
+
+    def data_segments(self, data, threshold: int = None) -> list:
+        """
+        Encodes the data into a list of segments, FileContent objects are kept as they are
+        (preceded by their binary header), so they can be mapped or read in chunks when the segments are sent.
+        Binaries of at least `threshold` bytes get their own segments as well instead of being copied.
+        """
+        segments = []
+        self.__encode_segments(data, segments, threshold)
+        tail = self.__flush()
+        if(tail):
+            segments.append(tail)
+        return segments
+
+    def message_segments(self, message: list, threshold: int = None) -> list:
+        """
+        Encodes the whole message (header and data) into segments, see data_segments().
+        """
+        packer = self._packer
+        packer.pack_array_header(len(message))
+        for field in message[:-1]:
+            packer.pack(field)
+        return self.data_segments(message[-1], threshold)
+
+    def __encode_segments(self, data, segments: list, threshold: int):
+        packer = self._packer
+        if(isinstance(data, (list, tuple))):
+            packer.pack_array_header(len(data))
+            for item in data:
+                self.__encode_segments(item, segments, threshold)
+        elif(isinstance(data, dict)):
+            packer.pack_map_header(len(data))
+            for key, value in data.items():
+                packer.pack(key)
+                self.__encode_segments(value, segments, threshold)
+        elif(isinstance(data, FileContent)):
+            segments.append(self.__flush() + MessageCodec.bin_header(len(data)))
+            segments.append(data)
+        elif(threshold is not None and isinstance(data, (bytes, bytearray, memoryview)) and len(data) >= threshold):
+            view = memoryview(data).cast('B')
+            segments.append(self.__flush() + MessageCodec.bin_header(len(view)))
+            segments.append(view)
+        else:
+            packer.pack(data)
+
+    @staticmethod
+    def has_large_binaries(message: list, threshold: int = None) -> bool:
+        """
+        Whether the message is an EVENT with FileContent attachments or in-memory ones of at least `threshold` bytes.
+        Only these messages are encoded into segments, the others are packed as a whole.
+        """
+        if(message[9] != DataType.EVENT.value):
+            return False
+        data = message[10]
+        if(not isinstance(data, (list, tuple)) or len(data) < 2 or not isinstance(data[1], dict)):
+            return False
+        for content in data[1].values():
+            if(isinstance(content, FileContent)):
+                return True
+            if(threshold is not None and isinstance(content, (bytes, bytearray, memoryview)) and len(content) >= threshold):
+                return True
+        return False
+
+    @staticmethod
+    def bin_header(size: int) -> bytes:
+        """
+        The MessagePack header of a binary of the given size (the Packer cannot write it on its own).
+        """
+        if(size < (1 << 8)):
+            return struct.pack(">BB", 0xc4, size)
+        if(size < (1 << 16)):
+            return struct.pack(">BH", 0xc5, size)
+        return struct.pack(">BI", 0xc6, size)
+
+    @staticmethod
+    def fragments(segments: list, fragment_unit: int):
+        """
+        Yields the (offset, chunk) pairs of the encoded segments, every chunk is `fragment_unit` bytes long except the last one.
+        Whole chunks of large segments are memoryview slices, only the chunks spanning segments are copied.
+        """
+        buffer = bytearray()
+        offset = 0
+        for segment in segments:
+            view = segment.view() if isinstance(segment, FileContent) else memoryview(segment)
+            position = 0
+            if(buffer):
+                position = min(fragment_unit - len(buffer), len(view))
+                buffer += view[:position]
+                if(len(buffer) == fragment_unit):
+                    yield offset, bytes(buffer)
+                    offset += fragment_unit
+                    buffer = bytearray()
+            while(len(view) - position >= fragment_unit):
+                yield offset, view[position:position + fragment_unit]
+                offset += fragment_unit
+                position += fragment_unit
+            buffer += view[position:]
+        if(buffer):
+            yield offset, bytes(buffer)
+
+    @staticmethod
+    def default(obj):
+        if(isinstance(obj, FileContent)):
+            return obj.view()
+        raise TypeError(f"Cannot serialize {obj!r}")
+
+    def __flush(self) -> bytes:
+        try:
+            return self._packer.bytes()
+        finally:
+            self._packer.reset()
+
+
+class MessageUtil:
+    # msgpack.Packer instances are not thread-safe, every thread reuses its own
+    _local = threading.local()
+
+    @staticmethod
+    def pack(data):
+        packer = getattr(MessageUtil._local, 'packer', None)
+        if(packer is None):
+            packer = msgpack.Packer(use_bin_type=True, default=MessageCodec.default)
+            MessageUtil._local.packer = packer
+        return packer.pack(data)
+
+    @staticmethod
+    def unpack(data):
+        return msgpack.unpackb(data, raw=False)
+
+    @staticmethod
+    def create_header(header_type: DataType, **kwargs):
+        now = int(datetime.now().timestamp())
+        return [
+            kwargs.get('username', "user"),
+            kwargs.get('msgid', str(uuid.uuid4())),
+            kwargs.get('create_time', now),
+            kwargs.get('request_time', now),
+            kwargs.get('fragmented', False),
+            kwargs.get('first_fragment'),
+            kwargs.get('last_fragment'),
+            kwargs.get('offset'),
+            kwargs.get('full_data_size'),
+            header_type.value
+        ]
+
+    @staticmethod
+    def create_message_from_header_and_data(header: list, data: list):
+        msg = [] + header
+        msg.append(data)
+        return msg
+
+    @staticmethod
+    def create_login_data(**kwargs):
+        return [
+            kwargs.get('serve_on_same', False),
+            #current GDS version is 5.1, therefore
+            #the major version is set to 5 while the minor to 1.
+            kwargs.get('version', (5 << 16 | 1)),
+            kwargs.get('fragment_support', False),
+            kwargs.get('fragment_unit', None),
+            kwargs.get('reserved', [None])
+        ]
+
+
+    @staticmethod
+    def create_event_data2(**kwargs):
+        binary_contents = kwargs.get('binary_contents', {})
+        if(kwargs.get('files')):
+            for fname in kwargs.get('files').split(';'):
+                if(kwargs.get('stream_files', True)):
+                    # the file is memory-mapped only when the message is sent
+                    if(not os.path.isfile("attachments/" + fname)):
+                        raise FileNotFoundError(
+                            f"The file named '{fname}' does not exist or could not be opened!")
+                    binary_contents[MessageUtil.hex(fname)] = FileContent("attachments/" + fname)
+                    continue
+                try:
+                    with open("attachments/" + fname, "rb") as file:
+                        hexname = MessageUtil.hex(fname)
+                        binary_contents[hexname] = file.read()
+                except Exception as e:
+                    raise FileNotFoundError(
+                        f"The file named '{fname}' does not exist or could not be opened!")
+
+        return [
+            kwargs.get('eventstr'),
+            binary_contents,
+            kwargs.get('priority_levels', [])
+        ]
+
+    @staticmethod
+    def create_attachment_request_data4(attstr: str):
+        return attstr
+
+    @staticmethod
+    def create_attachment_response_ack_data7(**kwargs):
+        return [
+            kwargs.get('globalstatus', 200),
+            [
+                kwargs.get('localstatus', 201),
+                dict({
+                    "requestids": kwargs.get('requestids'),
+                    "ownertable": kwargs.get('ownertable'),
+                    "attachmentid": kwargs.get('attachmentid')
+                })
+            ],
+            None
+        ]
+
+
+    @staticmethod
+    def create_event_document_data8(**kwargs):
+        return [
+            kwargs.get('tablename'),
+            kwargs.get('fielddescriptors'),
+            kwargs.get('records'),
+            kwargs.get('returningoptions', dict({}))
+        ]
+
+
+    @staticmethod
+    def create_event_document_ack_data9(**kwargs):
+        return [
+            kwargs.get('globalstatus', 200),
+            kwargs.get('result'),
+            None
+        ]
+
+    @staticmethod
+    def create_query_request_data10(**kwargs):
+        return [
+            kwargs.get('querystr'),
+            kwargs.get('consistency', "PAGES"),
+            kwargs.get('timeout', 60000)
+        ]
+
+    @staticmethod
+    def create_next_query_page_data12(context: list, **kwargs):
+        return [
+            context,
+            kwargs.get('timeout', 60000)
+        ]
+
+    @staticmethod
+    def create_message_from_data(header_type: DataType, **kwargs):
+        # the header list is freshly created, so the data can be appended without copying it
+        message = MessageUtil.create_header(header_type, **kwargs)
+        message.append(kwargs.get('data'))
+        return message
+
+    @staticmethod
+    def get_status(message: list):
+        """
+        The (global) status code of an ACK message, None if the message has no status code.
+        """
+        data = message[10]
+        if(isinstance(data, list) and data and isinstance(data[0], int)):
+            return data[0]
+        return None
+
+    @staticmethod
+    def split_statements(eventstr: str) -> list:
+        """
+        Splits the string into its statements by the semicolons which are not inside quotes.
+        """
+        statements = []
+        quote = None
+        start = 0
+        for i, char in enumerate(eventstr):
+            if(quote is not None):
+                if(char == quote):
+                    quote = None
+            elif(char == "'" or char == '"'):
+                quote = char
+            elif(char == ';'):
+                statements.append(eventstr[start:i])
+                start = i + 1
+        statements.append(eventstr[start:])
+        return [statement.strip() for statement in statements if statement.strip()]
 
     @staticmethod
     def hex(text: str) -> str:
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+from GDSClient import GDSClient, MessageCodec, MessageUtil, DataType
+from gds_simulator import run_simulator
+import argparse
+import asyncio
+import json
+import resource
+import socket
+import sys
+import time
+import traceback
+from multiprocessing import Process
+
+
+class CountingSocket:
+    """
+    Wraps the websocket of a client to count the bytes sent and received.
+    """
+    def __init__(self, ws):
+        self.ws = ws
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    async def send(self, data):
+        # a list is sent as the frames of one message
+        self.bytes_sent += sum(len(frame) for frame in data) if isinstance(data, list) else len(data)
+        await self.ws.send(data)
+
+    async def recv(self):
+        data = await self.ws.recv()
+        self.bytes_received += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, latencies: list, elapsed: float, transferred: int, errors: int = 0):
+        latencies = sorted(latencies)
+        self.name = name
+        self.requests = len(latencies)
+        self.errors = errors
+        self.requests_per_sec = (self.requests / elapsed) if elapsed > 0 else 0.0
+        self.p50 = BenchmarkResult.percentile(latencies, 0.50)
+        self.p99 = BenchmarkResult.percentile(latencies, 0.99)
+        self.bytes_per_sec = (transferred / elapsed) if elapsed > 0 else 0.0
+        self.peak_rss = BenchmarkResult.peak_rss()
+
+    @staticmethod
+    def percentile(values: list, p: float) -> float:
+        if(not values):
+            return 0.0
+        return values[int(p * (len(values) - 1))]
+
+    @staticmethod
+    def peak_rss() -> int:
+        # kilobytes on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+    def as_dict(self) -> dict:
+        return dict({
+            "name": self.name,
+            "requests": self.requests,
+            "errors": self.errors,
+            "requests_per_sec": self.requests_per_sec,
+            "p50_ms": self.p50 * 1000,
+            "p99_ms": self.p99 * 1000,
+            "bytes_per_sec": self.bytes_per_sec,
+            "peak_rss_bytes": self.peak_rss
+        })
+
+    def __str__(self):
+        return f"{self.name:<18}{self.requests:>9}{self.errors:>8}{self.requests_per_sec:>12.1f}" \
+            f"{self.p50 * 1000:>10.3f}{self.p99 * 1000:>10.3f}{self.bytes_per_sec / (1 << 20):>10.2f}{self.peak_rss / (1 << 20):>10.1f}"
+
+    HEADER = f"{'method':<18}{'requests':>9}{'errors':>8}{'req/sec':>12}{'p50 ms':>10}{'p99 ms':>10}{'MiB/sec':>10}{'RSS MiB':>10}"
+
+
+EVENT_STRING = "UPDATE multi_event SET speed = 15 WHERE id='EVNT2006241023125470'"
+QUERY_STRING = "SELECT * FROM multi_event"
+ATTACHMENT_STRING = "SELECT * FROM \"multi_event-@attachment\" WHERE id='ATID2006241023125470' and ownerid='EVNT2006241023125470' FOR UPDATE WAIT 86400"
+FIELD_DESCRIPTORS = [["id", "KEYWORD", "text/plain"], ["speed", "INTEGER", ""]]
+
+
+async def request_event(client: GDSClient, state: dict):
+    await client.send_event2(eventstr=EVENT_STRING)
+
+async def request_query(client: GDSClient, state: dict):
+    await client.send_query_request10(querystr=QUERY_STRING)
+
+async def request_next_query_page(client: GDSClient, state: dict):
+    if(state.get('context') is None):
+        reply, more_page = await client.send_query_request10(querystr=QUERY_STRING)
+        state['context'] = reply[10][1][3]
+    await client.send_next_query_page12(data=MessageUtil.create_next_query_page_data12(state['context']))
+
+async def request_prepared_query(client: GDSClient, state: dict):
+    if(state.get('prepared') is None):
+        state['prepared'] = client.prepare(DataType.QUERY_REQUEST, querystr=QUERY_STRING)
+    await state['prepared'].send()
+
+async def request_query_all(client: GDSClient, state: dict):
+    async for page in client.query_pages(QUERY_STRING, prefetch=2):
+        pass
+
+async def request_attachment(client: GDSClient, state: dict):
+    await client.send_attachment_request4(attachstr=ATTACHMENT_STRING)
+
+async def request_event_document(client: GDSClient, state: dict):
+    records = [[f"EVNT{i:016d}", i] for i in range(state['batch_size'])]
+    await client.send_event_document8(tablename="multi_event", fielddescriptors=FIELD_DESCRIPTORS, records=records)
+
+REQUESTS = dict({
+    "event": request_event,
+    "query": request_query,
+    "next_query_page": request_next_query_page,
+    "prepared_query": request_prepared_query,
+    "query_all": request_query_all,
+    "attachment": request_attachment,
+    "event_document": request_event_document
+})
+
+
+async def benchmark_method(name: str, client: GDSClient, requests: int, concurrency: int, batch_size: int) -> BenchmarkResult:
+    state = dict({"batch_size": batch_size})
+    request = REQUESTS[name]
+    # one warm-up request, so the paging context and the connection are ready
+    await request(client, state)
+    latencies = []
+    errors = 0
+    remaining = [requests]
+    counter = client.ws
+    sent, received = counter.bytes_sent, counter.bytes_received
+
+    async def worker():
+        nonlocal errors
+        while(remaining[0] > 0):
+            remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                await request(client, state)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for i in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    transferred = counter.bytes_sent - sent + counter.bytes_received - received
+    return BenchmarkResult(name, latencies, elapsed, transferred, errors)
+
+
+def benchmark_codec(requests: int, page_size: int) -> list:
+    codec = MessageCodec()
+    records = [[f"EVNT{i:016d}", i % 200, i / 7.0] + ["x" * 16] * 5 for i in range(page_size)]
+    message = MessageUtil.create_message_from_data(DataType.QUERY_REQUEST_ACK,
+        data=[200, [page_size, page_size, False, None, FIELD_DESCRIPTORS, records], None])
+    results = []
+    for name, function, argument in [
+            ("pack", codec.pack, message),
+            ("unpack", codec.unpack, codec.pack(message))]:
+        latencies = []
+        started = time.perf_counter()
+        for i in range(requests):
+            call_started = time.perf_counter()
+            function(argument)
+            latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+        size = len(argument) if isinstance(argument, bytes) else len(codec.pack(argument))
+        results.append(BenchmarkResult(name, latencies, elapsed, size * requests))
+    return results
+
+
+def start_simulator(**kwargs) -> Process:
+    process = Process(target=_simulator_process, kwargs=kwargs, daemon=True)
+    process.start()
+    deadline = time.monotonic() + 10
+    while(time.monotonic() < deadline):
+        try:
+            with socket.create_connection((kwargs.get('host'), kwargs.get('port')), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise TimeoutError("The GDS simulator did not start in time!")
+
+
+def _simulator_process(**kwargs):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(run_simulator(**kwargs))
+
+
+async def run_benchmarks(**kwargs) -> list:
+    results = []
+    async with GDSClient(url=kwargs.get('url'), username=kwargs.get('username'), password=kwargs.get('password'),
+            timeout=kwargs.get('timeout'), cert=kwargs.get('cert'), secret=kwargs.get('secret')) as client:
+        client.ws = CountingSocket(client.ws)
+        for name in kwargs.get('methods').split(','):
+            if(name in ("pack", "unpack")):
+                continue
+            if(name not in REQUESTS):
+                raise ValueError(f"Unknown method: '{name}'! Choose from: {', '.join(REQUESTS)}, pack, unpack")
+            result = await benchmark_method(name, client, kwargs.get('requests'), kwargs.get('concurrency'), kwargs.get('batch_size'))
+            print(result)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Throughput and latency benchmark of the GDS client')
+
+    parser.add_argument("-url", default=None,
+                        help="The URL of the GDS to benchmark against. If not set, a local simulator is started.")
+    parser.add_argument("-username", default="user", help="The username used for login.")
+    parser.add_argument("-password", default=None, help="The password used for login.")
+    parser.add_argument("-cert", default=None, help="The PKCS12 certificate file for TLS connections.")
+    parser.add_argument("-secret", default=None, help="The password of the certificate file.")
+    parser.add_argument("-timeout", default=30, type=int, help="The timeout of the requests in seconds.")
+    parser.add_argument("-requests", default=1000, type=int, help="The number of requests sent for every method.")
+    parser.add_argument("-concurrency", default=16, type=int, help="The number of requests in flight at the same time.")
+    parser.add_argument("-batch_size", default=100, type=int, help="The number of records in an EVENT_DOCUMENT message.")
+    parser.add_argument("-methods", default="event,query,prepared_query,next_query_page,query_all,attachment,event_document,pack,unpack",
+                        help="Comma separated list of the benchmarked methods.")
+    parser.add_argument("-json", default=None, help="Save the results to this JSON file as well.")
+    parser.add_argument("-port", default=8899, type=int, help="The port of the local simulator.")
+    parser.add_argument("-latency", default=0.0, type=float, help="The reply latency of the local simulator in seconds.")
+    parser.add_argument("-page_size", default=300, type=int, help="The query page size of the local simulator.")
+    parser.add_argument("-total_rows", default=3000, type=int, help="The number of rows of the queries of the local simulator.")
+    parser.add_argument("-attachment_size", default=65536, type=int, help="The attachment size of the local simulator.")
+
+    args = vars(parser.parse_args())
+    simulator = None
+    if(args.get('url') is None):
+        simulator = start_simulator(host="127.0.0.1", port=args.get('port'), latency=args.get('latency'),
+            page_size=args.get('page_size'), total_rows=args.get('total_rows'), attachment_size=args.get('attachment_size'))
+        args['url'] = f"ws://127.0.0.1:{args.get('port')}/gate"
+    try:
+        print(BenchmarkResult.HEADER)
+        results = asyncio.get_event_loop().run_until_complete(run_benchmarks(**args))
+        methods = args.get('methods').split(',')
+        for result in benchmark_codec(args.get('requests'), args.get('page_size')):
+            if(result.name in methods):
+                print(result)
+                results.append(result)
+    finally:
+        if(simulator is not None):
+            simulator.terminate()
+    if(args.get('json')):
+        with open(args.get('json'), "w") as file:
+            json.dump([result.as_dict() for result in results], file, indent=4)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print("Some error happened during running, benchmark is now closing! Details:")
+        traceback.print_exc(file=sys.stdout)
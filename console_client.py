@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from GDSClient import GDSClient, MessageUtil, DataType
+# the client modules are imported only when they are needed, so the `-hex` command starts fast
 import asyncio
 import sys, traceback
 
@@ -19,6 +19,7 @@ def event_ack(client, response: list, **kwargs):
                 client.save_object_to_json(response[1], response)
 
 def query_ack(client, response: list, **kwargs):
+        from GDSClient import QueryAck
         client.print_reply(response, **kwargs)
         max_length = 12
         response_body = response[10]
@@ -28,27 +29,166 @@ def query_ack(client, response: list, **kwargs):
             return False, None
         else:
             print(
-                f"Query was successful! Total of {response_body[1][0]} record(s) returned.")
+                f"Query was successful! Total of {QueryAck(response).number_of_hits} record(s) returned.")
             if not kwargs.get('skip_export'):
                 client.save_object_to_json(response[1], response)
 
 def attachment_ack(client, response: list, **kwargs) -> bool:
+        from GDSClient import AttachmentAck
         client.print_reply(response, **kwargs)
-        response_body = response[10]
-        if(not client.is_ack_ok(response, [200, 201, 202])):
+        ack = AttachmentAck(response)
+        if(not ack.is_ok((200, 201, 202))):
             print("Error during the attachment request!")
-            client.printErrorInACK(response_body)
+            client.printErrorInACK(ack.data)
         else:
-            if(response_body[1][1].get('attachment')):
-                attachment = response_body[1][1].get('attachment')
+            if(ack.attachment):
                 print(f"We got the attachment!")
                 if not kwargs.get('skip_export'):
-                    client.save_attachment(response_body[1][1].get(
-                        'attachmentid'), attachment, format=response_body[1][1].get('meta'))
+                    client.save_attachment(ack.attachmentid, ack.attachment, format=ack.meta)
             else:
                 print("This should never happen!")
 
+async def daemon_client(**kwargs):
+    from GDSClient import GDSClient, MessageUtil, DataType
+    from gds_daemon import daemon_request
+    # only the printing and saving helpers of the client are used, it does not connect
+    client = GDSClient(**dict(kwargs, cert=None, secret=None))
+    handlers = dict({"event": event_ack, "attachment": attachment_ack, "query": query_ack, "queryall": query_ack})
+    for command, handler in handlers.items():
+        if(kwargs.get(command)):
+            break
+    binary_contents = dict({})
+    if(command == "event" and kwargs.get('attachments')):
+        for fname in kwargs.get('attachments').split(';'):
+            with open("attachments/" + fname, "rb") as file:
+                binary_contents[MessageUtil.hex(fname)] = file.read()
+    async for reply in daemon_request(kwargs.get('daemon'), command, kwargs.get(command), binary_contents=binary_contents):
+        message_type = DataType(reply[9])
+        print(f"Incoming message of type {message_type.name}")
+        handler(client, reply, **kwargs)
+
+def parse_batch_line(line: str) -> dict:
+    """
+    A line of a batch file is either a JSON object (with `command`, `value` and optionally `id` and `attachments` fields)
+    or a plain statement: SELECTs from attachment tables are ATTACHMENT requests, other SELECTs are queries, the rest are events.
+    """
+    import json
+    line = line.strip()
+    if(line.startswith("{")):
+        request = json.loads(line)
+        if(request.get('command') not in ("event", "attachment", "query", "queryall")):
+            raise ValueError(f"Unknown command in the batch: {request.get('command')}")
+        return request
+    if(line[:6].upper() != "SELECT"):
+        return dict({"command": "event", "value": line})
+    if("-@attachment" in line):
+        return dict({"command": "attachment", "value": line})
+    return dict({"command": "query", "value": line})
+
+async def run_batch_request(client, request: dict):
+    from GDSClient import MessageUtil
+    command, value = request.get('command'), request.get('value')
+    if(command == "event"):
+        binary_contents = dict({})
+        for fname in (request.get('attachments') or "").split(';'):
+            if(fname):
+                with open("attachments/" + fname, "rb") as file:
+                    binary_contents[MessageUtil.hex(fname)] = file.read()
+        reply = await client.send_event2(eventstr=value, binary_contents=binary_contents)
+        return MessageUtil.get_status(reply), reply[10]
+    if(command == "attachment"):
+        reply = await client.send_attachment_request4(attachstr=value)
+        return MessageUtil.get_status(reply), reply[10]
+    if(command == "query"):
+        reply, more_page = await client.send_query_request10(querystr=value)
+        return MessageUtil.get_status(reply), reply[10]
+    pages = await client.query_all(value)
+    status = next((MessageUtil.get_status(page) for page in pages if not client.is_ack_ok(page)), MessageUtil.get_status(pages[-1]))
+    return status, [page[10] for page in pages]
+
+async def batch_client(**kwargs):
+    """
+    Runs the requests of the batch file (or the standard input) concurrently and writes their results
+    to the standard output as JSON lines, the summary is printed to the standard error.
+    """
+    from GDSClient import GDSClientPool, QueryExporter
+    import json, time
+    concurrency = kwargs.get('concurrency')
+    ordered = kwargs.get('ordered')
+    loop = asyncio.get_event_loop()
+    source = sys.stdin if kwargs.get('batch') == "-" else open(kwargs.get('batch'), "r", encoding="utf-8")
+    # in ordered mode a slot is freed only when the result was written, so at most `concurrency` results wait
+    slots = asyncio.Semaphore(concurrency)
+    results = dict()
+    latencies = []
+    errors = 0
+    next_index = 0
+    tasks = set()
+
+    def emit(index: int, result: dict):
+        nonlocal next_index
+        if(not ordered):
+            print(json.dumps(result, separators=(',', ':'), default=QueryExporter.json_default), flush=True)
+            slots.release()
+            return
+        results[index] = result
+        while(next_index in results):
+            print(json.dumps(results.pop(next_index), separators=(',', ':'), default=QueryExporter.json_default), flush=True)
+            next_index += 1
+            slots.release()
+
+    async def run(pool, index: int, line: str):
+        nonlocal errors
+        result = dict({"index": index})
+        started = time.perf_counter()
+        try:
+            request = parse_batch_line(line)
+            result.update({"id": request.get('id'), "command": request.get('command')})
+            async with pool.lease() as client:
+                result["status"], result["data"] = await run_batch_request(client, request)
+            if(result["status"] not in (200, 201, 202)):
+                errors += 1
+        except Exception as e:
+            errors += 1
+            result["error"] = f"{type(e).__name__}: {e}"
+        latency = time.perf_counter() - started
+        latencies.append(latency)
+        result["latency_ms"] = round(latency * 1000, 3)
+        emit(index, result)
+
+    started = time.perf_counter()
+    try:
+        async with GDSClientPool(size=kwargs.get('connections'), max_in_flight=concurrency, quiet=True, **dict(kwargs, attachments=None)) as pool:
+            index = 0
+            while True:
+                line = await loop.run_in_executor(None, source.readline)
+                if(not line):
+                    break
+                if(not line.strip()):
+                    continue
+                await slots.acquire()
+                task = asyncio.ensure_future(run(pool, index, line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+            if(tasks):
+                await asyncio.gather(*tasks)
+    finally:
+        if(source is not sys.stdin):
+            source.close()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    percentile = lambda p: latencies[int(p * (len(latencies) - 1))] * 1000 if latencies else 0.0
+    print(f"{len(latencies)} request(s), {errors} error(s) in {elapsed:.3f} seconds, "
+        f"{(len(latencies) / elapsed) if elapsed > 0 else 0.0:.1f} requests/sec, "
+        f"latency p50: {percentile(0.5):.3f} ms, p99: {percentile(0.99):.3f} ms, max: {percentile(1.0):.3f} ms", file=sys.stderr)
+
 async def console_client(**kwargs):
+    from GDSClient import GDSClient, DataType
+    if(kwargs.get('batch')):
+        return await batch_client(**kwargs)
+    if(kwargs.get('daemon') and not kwargs.get('export')):
+        return await daemon_client(**kwargs)
     async with GDSClient(**kwargs) as client:
         if(client.args.get('event')):
             event_reply = await client.send_event2(eventstr=kwargs.get('event'))
@@ -66,15 +206,13 @@ async def console_client(**kwargs):
             print(f"Incoming message of type {message_type.name}")
             query_ack(client, query_reply, **kwargs)
         elif(client.args.get('queryall')):
-            query_reply, more_page = await client.send_query_request10(querystr=kwargs.get('queryall'))
-            message_type = DataType(query_reply[9])
-            print(f"Incoming message of type {message_type.name}")
-            query_ack(client, query_reply, **kwargs)
-            while(more_page):
-        	    query_reply, more_page = await client.send_next_query_page12(prev_page=query_reply)
-	            message_type = DataType(query_reply[9])
-	            print(f"Incoming message of type {message_type.name}")
-        	    query_ack(client, query_reply, **kwargs)
+            async for query_reply in client.query_pages(kwargs.get('queryall')):
+                message_type = DataType(query_reply[9])
+                print(f"Incoming message of type {message_type.name}")
+                query_ack(client, query_reply, **kwargs)
+        elif(client.args.get('export')):
+            stats = await client.export(kwargs.get('export'), kwargs.get('output'), kwargs.get('format'), prefetch=2)
+            print(f"Exported {stats['rows']} record(s) from {stats['pages']} page(s) into `{stats['path']}`.")
         else:
             pass
         
@@ -108,14 +246,31 @@ def main():
         '-query', help="The SELECT string you would like to use.")
     group.add_argument(
         '-queryall', help="The SELECT string you would like to use. This will query all pages, not just the first one.")
+    group.add_argument(
+        '-export', help="The SELECT string you would like to use. Every page is written into the file given by the `-output` flag.")
+    group.add_argument(
+        '-batch', help="The file of the requests (one statement or JSON object per line) to run concurrently, `-` reads the standard input.")
     
+    parser.add_argument(
+        "-concurrency", default=16, type=int, help="The number of `-batch` requests running at the same time.")
+    parser.add_argument(
+        "-connections", default=1, type=int, help="The number of connections the `-batch` requests are sent on.")
+    parser.add_argument(
+        "-ordered", action="store_true", help="Write the results of the `-batch` requests in the order of the input instead of the order they complete.")
+    parser.add_argument(
+        "-output", default="exports/export.jsonl", help="The file of the `-export` command. Its format is chosen by its extension (`.jsonl`, `.parquet` or `.arrow`).")
+    parser.add_argument(
+        "-format", default=None, choices=["jsonl", "parquet", "arrow"], help="The format of the `-export` file, if it is not given by its extension.")
+    parser.add_argument(
+        "-daemon", default=None, help="The Unix socket of a running `gds_daemon.py`. If set, the request is sent through its open sessions instead of a new connection.")
     parser.add_argument(
         "-attachments", default="", help="List of your files you want to send from the `attachments` folder next to this script.")
 
     args = vars(parser.parse_args())
     if(args.get('hex')):
         for arg in args.get('hex').split(';'):
-            hexvalue = MessageUtil.hex(arg)
+            # the same as MessageUtil.hex(..), without loading the client
+            hexvalue = arg.encode().hex()
             print(f"The hex value of `{arg}` is: 0x{hexvalue}")
         return
 
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+from GDSClient import GDSClientPool, MessageException, MessageUtil
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import traceback
+
+
+class GDSDaemon:
+    """
+    Keeps logged-in connections to the GDS open and serves the requests of the console client over a Unix socket,
+    so the client does not have to connect and log in every time it is started.
+    Every request and reply is a MessagePack map preceded by its length (4 bytes, big-endian).
+    """
+    COMMANDS = ("event", "attachment", "query", "queryall")
+
+    def __init__(self, socket_path: str, size: int = 2, **kwargs):
+        self.socket_path = socket_path
+        self.size = size
+        self.args = kwargs
+        self.pool = None
+        self.server = None
+
+    async def start(self):
+        self.pool = await GDSClientPool(size=self.size, **self.args).open()
+        if(os.path.exists(self.socket_path)):
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(self.handler, path=self.socket_path)
+        # only the owner can send requests with the logged-in sessions
+        os.chmod(self.socket_path, 0o600)
+        return self
+
+    async def stop(self):
+        if(self.server is not None):
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if(os.path.exists(self.socket_path)):
+            os.unlink(self.socket_path)
+        if(self.pool is not None):
+            await self.pool.close()
+            self.pool = None
+
+    async def handler(self, reader, writer):
+        try:
+            while True:
+                request = await read_frame(reader)
+                if(request is None):
+                    break
+                try:
+                    async with self.pool.lease() as client:
+                        async for reply in self.replies(client, request):
+                            await write_frame(writer, dict({"reply": reply}))
+                    await write_frame(writer, dict({"done": True}))
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    await write_frame(writer, dict({"error": f"{type(e).__name__}: {e}"}))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def replies(self, client, request: dict):
+        command = request.get("command")
+        value = request.get("value")
+        if(command == "event"):
+            yield await client.send_event2(eventstr=value, binary_contents=request.get("binary_contents") or dict({}))
+        elif(command == "attachment"):
+            yield await client.send_attachment_request4(attachstr=value)
+        elif(command == "query"):
+            query_reply, more_page = await client.send_query_request10(querystr=value)
+            yield query_reply
+        elif(command == "queryall"):
+            async for query_reply in client.query_pages(value):
+                yield query_reply
+        else:
+            raise ValueError(f"Unknown command: '{command}'! Choose from: {', '.join(GDSDaemon.COMMANDS)}")
+
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(4)
+    except asyncio.IncompleteReadError as e:
+        if(e.partial):
+            raise
+        return None
+    size = struct.unpack(">I", header)[0]
+    return MessageUtil.unpack(await reader.readexactly(size))
+
+
+async def write_frame(writer, frame: dict):
+    data = MessageUtil.pack(frame)
+    writer.write(struct.pack(">I", len(data)) + data)
+    await writer.drain()
+
+
+async def daemon_request(socket_path: str, command: str, value: str, **kwargs):
+    """
+    Sends one request to the daemon listening on `socket_path` and yields its replies.
+    """
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        await write_frame(writer, dict({"command": command, "value": value}, **kwargs))
+        while True:
+            frame = await read_frame(reader)
+            if(frame is None):
+                raise MessageException("The daemon closed the connection!")
+            if(frame.get("error") is not None):
+                raise MessageException(f"The daemon could not serve the request! Details: {frame.get('error')}")
+            if(frame.get("done")):
+                return
+            yield frame.get("reply")
+    finally:
+        writer.close()
+
+
+async def run_daemon(**kwargs):
+    daemon = await GDSDaemon(**kwargs).start()
+    print(f"GDS daemon is listening on {daemon.socket_path}")
+    try:
+        await asyncio.Future()
+    finally:
+        await daemon.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Keeps logged-in GDS sessions open for the console client (see its -daemon flag)')
+
+    parser.add_argument("-socket", dest="socket_path", default="/tmp/gds_daemon.sock",
+                        help="The path of the Unix socket the daemon listens on.")
+    parser.add_argument("-size", default=2, type=int, help="The number of connections kept open.")
+    parser.add_argument("-username", default="user", help="The username you would like to use for login to the GDS.")
+    parser.add_argument("-password", help="The password you would like to use when logging in to the GDS.")
+    parser.add_argument("-timeout", default=30, type=int,
+                        help="The timeout of your queries (in seconds) before the waiting for the response will be interrupted.")
+    parser.add_argument("-url", default="ws://127.0.0.1:8888/gate",
+                        help="The URL of the GDS instance you would like to connect to.")
+    parser.add_argument("-cert", default=None,
+                        help="The name of your PKCS12 certificate file ('*.p12') if you want to use secure connection.")
+    parser.add_argument("-secret", default=None, help="The password for your certificate ('*.p12') file.")
+
+    args = vars(parser.parse_args())
+    asyncio.get_event_loop().run_until_complete(run_daemon(reconnect=True, **args))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print("Some error happened during running, daemon is now closing! Details:")
+        traceback.print_exc(file=sys.stdout)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+from GDSClient import DataType, MessageCodec, MessageUtil
+import argparse
+import asyncio
+import random
+import sys
+import time
+import traceback
+import websockets
+
+
+class GDSSimulator:
+    """
+    A local GDS gateway simulator for testing and benchmarking the client.
+    It answers the login, EVENT, EVENT_DOCUMENT, ATTACHMENT and QUERY (with paging) messages
+    with generated data after the configured latency.
+    """
+    def __init__(self, **kwargs):
+        self.host = kwargs.get('host', "127.0.0.1")
+        self.port = kwargs.get('port', 8888)
+        self.latency = kwargs.get('latency', 0.0)
+        self.jitter = kwargs.get('jitter', 0.0)
+        self.total_rows = kwargs.get('total_rows', 1000)
+        self.page_size = kwargs.get('page_size', 300)
+        self.row_width = kwargs.get('row_width', 8)
+        self.value_size = kwargs.get('value_size', 16)
+        self.attachment_size = kwargs.get('attachment_size', 1024)
+        # if set, the attachment is sent in a separate ATTACHMENT_RESPONSE message
+        self.attachment_response = kwargs.get('attachment_response', False)
+        self.verbose = kwargs.get('verbose', False)
+        self.server = None
+
+        self.fielddescriptors = [["id", "KEYWORD", "text/plain"], ["speed", "INTEGER", ""], ["score", "DOUBLE", ""]] + \
+            [[f"field{i}", "KEYWORD", "text/plain"] for i in range(max(self.row_width - 3, 0))]
+        self.attachment = bytes(random.getrandbits(8) for i in range(min(self.attachment_size, 4096))) * \
+            (self.attachment_size // 4096 + 1)
+        self.attachment = self.attachment[:self.attachment_size]
+
+    async def start(self):
+        self.server = await websockets.serve(self.handler, self.host, self.port, max_size=None)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handler(self, websocket, path=None):
+        codec = MessageCodec()
+        fragments = dict()
+        tasks = set()
+        try:
+            async for frame in websocket:
+                message = codec.unpack(frame)
+                if(message[4]):
+                    message = self.reassemble(fragments, message, codec)
+                    if(message is None):
+                        continue
+                task = asyncio.ensure_future(self.answer(websocket, codec, message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def reassemble(self, fragments: dict, fragment: list, codec: MessageCodec):
+        buffer, received = fragments.get(fragment[1], (None, 0))
+        if(buffer is None):
+            buffer = bytearray(fragment[8])
+        buffer[fragment[7]:fragment[7] + len(fragment[10])] = fragment[10]
+        received += len(fragment[10])
+        if(received < len(buffer)):
+            fragments[fragment[1]] = (buffer, received)
+            return None
+        fragments.pop(fragment[1], None)
+        message = fragment[:10]
+        message.append(codec.unpack_data(buffer))
+        return message
+
+    async def answer(self, websocket, codec: MessageCodec, message: list):
+        message_type = DataType(message[9])
+        if(self.verbose):
+            print(f"Incoming {message_type.name} message (id: {message[1]})")
+        if(message_type == DataType.ATTACHMENT_RESPONSE_ACK or message_type == DataType.EVENT_DOCUMENT_ACK):
+            return
+        if(message_type != DataType.CONNECTION and (self.latency or self.jitter)):
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        replies = self.replies(message_type, message)
+        for reply in replies:
+            await websocket.send(codec.pack(reply))
+
+    def replies(self, message_type: DataType, message: list) -> list:
+        data = message[10]
+        if(message_type == DataType.CONNECTION):
+            return [self.reply(message, DataType.CONNECTION_ACK, [200, data, None])]
+        if(message_type == DataType.EVENT):
+            count = max(len(MessageUtil.split_statements(data[0] or "")), 1)
+            return [self.reply(message, DataType.EVENT_ACK, [200, [[200, "", dict({})] for i in range(count)], None])]
+        if(message_type == DataType.EVENT_DOCUMENT):
+            return [self.reply(message, DataType.EVENT_DOCUMENT_ACK, [200, [[200, "", dict({})] for record in data[2]], None])]
+        if(message_type == DataType.ATTACHMENT_REQUEST):
+            result = dict({
+                "requestids": [message[1]],
+                "ownertable": "multi_event-@attachment",
+                "attachmentid": "ATID2006241023125470",
+                "meta": "image/bmp"
+            })
+            if(not self.attachment_response):
+                result["attachment"] = self.attachment
+                return [self.reply(message, DataType.ATTACHMENT_REQUEST_ACK, [200, [201, result], None])]
+            response = dict(result)
+            response["attachment"] = self.attachment
+            return [
+                self.reply(message, DataType.ATTACHMENT_REQUEST_ACK, [200, [201, result], None]),
+                self.reply(message, DataType.ATTACHMENT_RESPONSE, [response, None], msgid=MessageUtil.hex(str(time.time())))
+            ]
+        if(message_type == DataType.QUERY_REQUEST):
+            return [self.reply(message, DataType.QUERY_REQUEST_ACK, self.page(data[0], data[1], 0))]
+        if(message_type == DataType.NEXT_QUERY_PAGE_REQUEST):
+            context = data[0]
+            return [self.reply(message, DataType.QUERY_REQUEST_ACK, self.page(context[1], context[4], context[2]))]
+        return [self.reply(message, DataType(message_type.value + 1), [400, None, f"Unsupported message type: {message_type.name}"])]
+
+    def reply(self, message: list, message_type: DataType, data, msgid=None) -> list:
+        return MessageUtil.create_message_from_data(message_type, username=message[0], msgid=msgid or message[1], data=data)
+
+    def page(self, querystr: str, consistency: str, delivered: int) -> list:
+        count = max(min(self.page_size, self.total_rows - delivered), 0)
+        records = [self.record(delivered + i) for i in range(count)]
+        delivered += count
+        has_more_pages = delivered < self.total_rows
+        context = ["simulator", querystr, delivered, int(time.time() * 1000), consistency, None, ["simulator", "simulator"], [], []]
+        return [200, [count, count, has_more_pages, context, self.fielddescriptors, records], None]
+
+    def record(self, index: int) -> list:
+        value = "x" * self.value_size
+        return [f"EVNT{index:016d}", index % 200, index / 7.0] + [value] * max(self.row_width - 3, 0)
+
+
+async def run_simulator(**kwargs):
+    simulator = await GDSSimulator(**kwargs).start()
+    print(f"GDS simulator is listening on ws://{simulator.host}:{simulator.port}/gate")
+    try:
+        await asyncio.Future()
+    finally:
+        await simulator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Local GDS gateway simulator for testing and benchmarking the client')
+
+    parser.add_argument("-host", default="127.0.0.1", help="The host the simulator listens on.")
+    parser.add_argument("-port", default=8888, type=int, help="The port the simulator listens on.")
+    parser.add_argument("-latency", default=0.0, type=float, help="The delay (in seconds) before every reply.")
+    parser.add_argument("-jitter", default=0.0, type=float, help="Random extra delay (in seconds) added to the latency.")
+    parser.add_argument("-total_rows", default=1000, type=int, help="The number of rows every query returns.")
+    parser.add_argument("-page_size", default=300, type=int, help="The number of rows on a query page.")
+    parser.add_argument("-row_width", default=8, type=int, help="The number of fields of the rows.")
+    parser.add_argument("-value_size", default=16, type=int, help="The length of the string fields of the rows.")
+    parser.add_argument("-attachment_size", default=1024, type=int, help="The size of the attachments in bytes.")
+    parser.add_argument("-attachment_response", action="store_true",
+                        help="Send the attachments in separate ATTACHMENT_RESPONSE messages.")
+    parser.add_argument("-verbose", action="store_true", help="Print every incoming message.")
+
+    args = vars(parser.parse_args())
+    asyncio.get_event_loop().run_until_complete(run_simulator(**args))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print("Some error happened during running, simulator is now closing! Details:")
+        traceback.print_exc(file=sys.stdout)